@@ -0,0 +1,63 @@
+"""Compares formatting huge code blocks as one tree with formatting them a line at a time.
+
+Run from the repository root with `python -m benchmarks.code_blocks`. Peak memory is measured
+with tracemalloc, which slows every path down, so it's measured on a separate run. The markup
+path only streams the markup of the block, without building the tree the other two end with.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Tuple
+
+from bs4 import BeautifulSoup
+
+from plugins.preformatted import Options, add_linenos, format_code_block_lines, highlight_code, iter_code_block_markup, wrap_lines
+from util import html_escape
+
+
+def format_whole_block(pre_contents: str, options: Options) -> BeautifulSoup:
+    pre_contents = add_linenos(highlight_code(pre_contents, options), options)
+    return wrap_lines(BeautifulSoup(f'<pre><code>{pre_contents}</code></pre>', 'html.parser'))
+
+
+def stream_markup(pre_contents: str, options: Options):
+    for _ in iter_code_block_markup(pre_contents, options):
+        pass
+
+
+def make_code(lines: int) -> Tuple[str, Options]:
+    code = ''.join(
+        f'result_{line} = some_function(argument, "a string {line}") + other_function(more, arguments)  # comment {line}\n'
+        for line in range(lines))
+    return html_escape(code), {'lang': 'python', 'linenos': True}
+
+
+def make_ascii_art(lines: int) -> Tuple[str, Options]:
+    rng = random.Random(lines)
+    art = ''.join(''.join(rng.choice(' |-+/\\_#') for _ in range(rng.randint(10, 120))) + '\n' for _ in range(lines))
+    return html_escape(art), {}
+
+
+def measure(format_block: Callable[[str, Options], Any], pre_contents: str, options: Options) -> Tuple[float, float]:
+    start = time.perf_counter()
+    format_block(pre_contents, options)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    format_block(pre_contents, options)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark formatting huge code blocks')
+    parser.add_argument('-l', '--lines', type=int, nargs='+', default=[1000, 4000])
+    args = parser.parse_args()
+
+    for name, make_block in [('code', make_code), ('ascii art', make_ascii_art)]:
+        for lines in args.lines:
+            pre_contents, options = make_block(lines)
+            for path, format_block in [('whole block', format_whole_block), ('by line', format_code_block_lines), ('markup', stream_markup)]:
+                elapsed, peak = measure(format_block, pre_contents, options)
+                print(f'{name:10} {lines:6} lines  {path:12} {elapsed:8.2f} s {peak:8.1f} MB peak')
@@ -0,0 +1,52 @@
+"""Compares the throughput of the single-pass dash engine with the chain of replaces it replaced.
+
+Run from the repository root with `python -m benchmarks.dashes [xml_dump]`.
+"""
+import argparse
+import re
+import time
+from xml.etree import ElementTree
+
+from bs4 import BeautifulSoup
+
+from prepress import CONTENT_TAG, dashify
+
+
+def chained_dashify(text: str) -> str:
+    return re.sub(r'(?<=\d) ?--? ?(?=\d)', '–', text) \
+        .replace(' - ', '—') \
+        .replace(' --- ', '—') \
+        .replace('---', '—') \
+        .replace(' -- ', '—') \
+        .replace('--', '—') \
+        .replace(' — ', '—') \
+        .replace('—', ' — ')
+
+
+def throughput(transform, texts, rounds: int) -> float:
+    """Returns the MB/s transform gets through texts.
+    """
+    size = sum(len(text.encode('utf-8')) for text in texts) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            transform(text)
+    return size / (time.perf_counter() - start) / 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark dash normalization')
+    parser.add_argument('xml_dump', nargs='?', default='tests/test-export.xml')
+    parser.add_argument('-r', '--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    texts = [
+        str(text)
+        for content in ElementTree.parse(args.xml_dump).getroot().iter(CONTENT_TAG) if content.text
+        for text in BeautifulSoup(content.text, 'html.parser').find_all(string=True)
+    ]
+    texts += ['The years 1990--1999 - a decade --- were, well, 10 - 20% better -- or worse.'] * 100
+    print(f'{len(texts)} text nodes')
+    # bypass the memoization so we measure the engine itself
+    print(f'chained replaces {throughput(chained_dashify, texts, args.rounds):8.2f} MB/s')
+    print(f'single pass      {throughput(dashify.__wrapped__, texts, args.rounds):8.2f} MB/s')
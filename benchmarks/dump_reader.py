@@ -0,0 +1,96 @@
+"""Compares reading one issue out of a large dump by memory-mapped byte scanning against
+ElementTree.parse and iterparse.
+
+Run from the repository root with `python -m benchmarks.dump_reader [-s size_mb]`. Dumps of several
+GB work too, but need as much free disk. Each reader runs in its own process so its peak memory
+can be measured. Peak memory of the mmap reader includes the pages of the dump it touched,
+which are shared with the page cache rather than owned by the process.
+"""
+import argparse
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree
+
+from plugins.wxr import iter_item_spans, read_tagged_items
+from prepress import filter_articles, filter_items
+
+TAG_REGEX = re.compile(rb'(<category domain="post_tag" nicename=")[^"]*("><!\[CDATA\[)[^\]]*(\]\]>)')
+ISSUE = 'v1i1'
+
+
+def generate_dump(template_path: str, path: str, size_mb: int):
+    """Writes a dump of roughly size_mb MB made of copies of the items in template_path, spread
+    over issues so that only the first copy of each item belongs to ISSUE.
+    """
+    with open(template_path, 'rb') as template_file:
+        template = template_file.read()
+    spans = list(iter_item_spans(template))
+    header = template[:spans[0][0]]
+    footer = template[spans[-1][1]:]
+    items = [template[start:end] for start, end in spans]
+    with open(path, 'wb') as dump_file:
+        dump_file.write(header)
+        copy = 0
+        while dump_file.tell() < size_mb * 1e6:
+            copy += 1
+            tag = f'v{copy}i1'.encode('utf-8')
+            for item in items:
+                dump_file.write(TAG_REGEX.sub(rb'\g<1>' + tag + rb'\g<2>' + tag + rb'\g<3>', item) + b'\n')
+        dump_file.write(footer)
+
+
+def read_parse(path: str):
+    return filter_articles(ElementTree.parse(path), ISSUE)
+
+
+def read_iterparse(path: str):
+    articles = []
+    for _, element in ElementTree.iterparse(path):
+        if element.tag == 'item':
+            articles += filter_items([element], ISSUE)
+            element.clear()
+    return articles
+
+
+def read_mmap(path: str):
+    return filter_items(read_tagged_items(path, ISSUE), ISSUE)
+
+
+READERS = {
+    'parse': read_parse,
+    'iterparse': read_iterparse,
+    'mmap': read_mmap,
+}
+
+
+def run_reader(reader: str, path: str):
+    start = time.perf_counter()
+    articles = READERS[reader](path)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{reader:10} {elapsed:8.2f} s {peak_mb:10.1f} MB peak {len(articles):6} articles')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark reading an issue out of an XML dump')
+    parser.add_argument('-t', '--template', default='tests/test-export.xml', help='dump whose items are copied')
+    parser.add_argument('-s', '--size', type=int, default=200, help='size of the generated dump in MB')
+    parser.add_argument('-r', '--readers', nargs='+', default=list(READERS), choices=list(READERS))
+    parser.add_argument('--run', nargs=2, metavar=('READER', 'DUMP'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_reader(*args.run)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'dump.xml')
+        generate_dump(args.template, path, args.size)
+        print(f'{os.path.getsize(path) / 1e6:.0f} MB dump')
+        for reader in args.readers:
+            subprocess.run([sys.executable, '-m', 'benchmarks.dump_reader', '--run', reader, path], check=True)
@@ -0,0 +1,46 @@
+"""Compares formatting an issue's code blocks without the highlight cache, with a cold cache and
+with a warm one, like on a second export of the same issue.
+
+Run from the repository root with `python -m benchmarks.highlight_cache`. The cache is kept in a
+temporary directory, so the real one is left alone.
+"""
+import argparse
+import tempfile
+import time
+from typing import Optional
+
+from bs4 import BeautifulSoup
+
+import plugins.highlight_cache
+import prepress
+from benchmarks.code_blocks import make_code
+from plugins.highlight_cache import HighlightCache
+
+
+def make_article(blocks: int, lines: int) -> str:
+    code, _ = make_code(lines)
+    return ''.join(f'<p>Block {block}</p>\n<pre>:lang: python\n:linenos:\n\n# block {block}\n{code}</pre>\n' for block in range(blocks))
+
+
+def measure(content: str, cache: Optional[HighlightCache]) -> float:
+    article = prepress.Article()
+    article.content = BeautifulSoup(content, 'html.parser')
+    plugins.highlight_cache.USE_HIGHLIGHT_CACHE = cache is not None
+    plugins.highlight_cache._cache = cache
+    start = time.perf_counter()
+    prepress.format_code_blocks(article)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the cache of formatted code blocks')
+    parser.add_argument('-b', '--blocks', type=int, default=40)
+    parser.add_argument('-l', '--lines', type=int, default=30, help='lines in each code block')
+    args = parser.parse_args()
+
+    content = make_article(args.blocks, args.lines)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        print(f'{"no cache":12} {measure(content, None):8.3f} s')
+        print(f'{"cold cache":12} {measure(content, HighlightCache(cache_dir)):8.3f} s')
+        # a new cache object, like a new run, so nothing is held in memory
+        print(f'{"warm cache":12} {measure(content, HighlightCache(cache_dir)):8.3f} s')
@@ -0,0 +1,57 @@
+"""Compares per-formula LaTeX compile latency with and without the precompiled preamble format.
+
+Run from the repository root with `python -m benchmarks.latex_format [-n COUNT]`. Needs pdflatex.
+"""
+import argparse
+import os.path
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from plugins import latex
+
+FORMULAS = [
+    r'x^2 + y^2 = z^2',
+    r'\sum_{i=1}^n i = \frac{n(n+1)}{2}',
+    r'\int_0^\infty e^{-x^2} \, dx = \frac{\sqrt{\pi}}{2}',
+    r'\forall n \in \Z, \exists q \in \Q : q > n',
+    r'\begin{pmatrix} a & b \\ c & d \end{pmatrix}',
+    r'\lim_{x \to 0} \frac{\sin x}{x} = 1',
+]
+
+
+def time_compiles(out_dir: str, count: int, use_format: bool):
+    timings = []
+    for i in range(count):
+        formula = FORMULAS[i % len(FORMULAS)]
+        start = time.perf_counter()
+        latex.compile_latex_str(formula, os.path.join(out_dir, f'{use_format:d}_{i}'), display=bool(i % 2), use_format=use_format)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings):
+    print(f'{name:<12} mean {statistics.mean(timings) * 1000:8.1f} ms'
+          f'  median {statistics.median(timings) * 1000:8.1f} ms'
+          f'  total {sum(timings):6.2f} s', flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark precompiled LaTeX formats')
+    parser.add_argument('-n', '--count', type=int, default=24, help='number of formulas to compile each way')
+    args = parser.parse_args()
+    if shutil.which(latex.LATEX_COMPILER) is None:
+        print(f'{latex.LATEX_COMPILER} not found, nothing to benchmark.')
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        latex.FORMAT_DIR = os.path.join(out_dir, 'formats')
+        start = time.perf_counter()
+        preamble, _ = latex.split_document(latex.make_document(FORMULAS[0]))
+        if latex.get_format(preamble) is None:
+            sys.exit(1)
+        print(f'format build {(time.perf_counter() - start) * 1000:8.1f} ms')
+        report('full', time_compiles(out_dir, args.count, use_format=False))
+        report('precompiled', time_compiles(out_dir, args.count, use_format=True))
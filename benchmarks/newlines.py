@@ -0,0 +1,65 @@
+"""Compares replace_newlines with the version that searched the siblings of every text node, on
+long flat articles.
+
+Run from the repository root with `python -m benchmarks.newlines`.
+"""
+import argparse
+import time
+from typing import Callable
+
+import bs4
+from bs4 import BeautifulSoup
+
+from prepress import Article, replace_newlines, separate_lines
+from util import keep_verbatim
+
+
+def searching_replace_newlines(article: Article) -> Article:
+    for text_tag in article.content.find_all(string=True):
+        if not keep_verbatim(text_tag):
+            prev_sibling = text_tag.find_previous_sibling()
+            next_sibling = text_tag.find_next_sibling()
+            new_tag = bs4.NavigableString(separate_lines(str(text_tag), prev_sibling != None, next_sibling != None))
+            text_tag.replace_with(new_tag)
+    return article
+
+
+def make_poem(lines: int) -> BeautifulSoup:
+    """A long poem with a tag every few lines.
+    """
+    stanzas = []
+    for line in range(lines):
+        stanzas.append(f'<em>Line {line}</em> goes on\n' if line % 4 == 0 else f'and on for line {line}\n')
+    return BeautifulSoup(''.join(stanzas), 'html.parser')
+
+
+def make_strings(lines: int) -> BeautifulSoup:
+    """Lots of strings next to each other, as splitting passes leave them, with a tag at either end.
+    """
+    soup = BeautifulSoup('<strong>Start</strong><strong>End</strong>', 'html.parser')
+    end = soup.contents[-1]
+    for line in range(lines):
+        end.insert_before(bs4.NavigableString(f'line {line}\n' if line % 2 else f'no break {line} '))
+    return soup
+
+
+def run(process: Callable[[Article], Article], make_soup: Callable[[int], BeautifulSoup], lines: int) -> float:
+    article = Article()
+    article.content = make_soup(lines)
+    start = time.perf_counter()
+    process(article)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark replace_newlines')
+    parser.add_argument('-l', '--lines', type=int, nargs='+', default=[1000, 2000, 4000])
+    args = parser.parse_args()
+
+    for name, make_soup in [('poem', make_poem), ('strings', make_strings)]:
+        for lines in args.lines:
+            separate_lines.cache_clear()
+            searching = run(searching_replace_newlines, make_soup, lines)
+            separate_lines.cache_clear()
+            single_walk = run(replace_newlines, make_soup, lines)
+            print(f'{name:8} {lines:6} lines  sibling search {searching:8.3f} s  single walk {single_walk:8.3f} s')
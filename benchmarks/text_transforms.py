@@ -0,0 +1,69 @@
+"""Compares the text passes with and without memoized string transforms on a real issue.
+
+Run from the repository root with `python -m benchmarks.text_transforms [issue] [xml_dump]`.
+Defaults to the issue in tests/test-export.xml.
+"""
+import argparse
+import time
+from xml.etree import ElementTree
+
+import prepress
+from util import MEMOIZED_TEXT_LENGTH
+
+TEXT_PASSES = [
+    prepress.replace_newlines,
+    prepress.replace_ellipses,
+    prepress.replace_dashes,
+    prepress.remove_extraneous_spaces,
+]
+TRANSFORMS = ['separate_lines', 'ellipsize', 'dashify', 'collapse_spaces']
+
+
+def run_passes(articles) -> float:
+    """Returns the seconds spent in the text passes over one export of articles.
+    """
+    # caches start cold on every export
+    for name in TRANSFORMS:
+        transform = getattr(prepress, name)
+        if hasattr(transform, 'cache_clear'):
+            transform.cache_clear()
+    parsed = [article.parse() for article in articles]
+    start = time.perf_counter()
+    for article in parsed:
+        for process in TEXT_PASSES:
+            process(article)
+    return time.perf_counter() - start
+
+
+def run_unmemoized(articles) -> float:
+    cached = {name: getattr(prepress, name) for name in TRANSFORMS}
+    try:
+        for name, transform in cached.items():
+            setattr(prepress, name, transform.__wrapped__)
+        return run_passes(articles)
+    finally:
+        for name, transform in cached.items():
+            setattr(prepress, name, transform)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark memoized text transforms')
+    parser.add_argument('issue', nargs='?', default='v1xxiy')
+    parser.add_argument('xml_dump', nargs='?', default='tests/test-export.xml')
+    parser.add_argument('-r', '--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    articles = prepress.filter_articles(ElementTree.parse(args.xml_dump), args.issue)
+    # rounds alternate between the two, and the best round of each is kept, so neither
+    # pays for warming up or for whatever else the machine is doing
+    memoized = plain = float('inf')
+    for _ in range(args.rounds):
+        memoized = min(memoized, run_passes(articles))
+        stats = prepress.get_transform_cache_stats()
+        plain = min(plain, run_unmemoized(articles))
+
+    print(f'{len(articles)} articles, best of {args.rounds} rounds')
+    print(f'uncached {plain * 1000:8.1f} ms')
+    print(f'memoized {memoized * 1000:8.1f} ms  ({plain / memoized:.2f}x)')
+    for name, hits, misses in stats:
+        print(f'  {name:<16}{hits / max(hits + misses, 1):8.1%} hit rate on text up to {MEMOIZED_TEXT_LENGTH} characters')
@@ -0,0 +1,131 @@
+import concurrent.futures
+import html
+import os.path
+import re
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# Number of files downloaded at once
+DOWNLOAD_WORKERS = 8
+# A <link> tag to a local file, as it comes out in the output
+LINK_TAG_REGEX = re.compile(r'<link\b[^<>]*?\bhref="file://([^"]*)"[^<>]*?(?:/>|></link>)')
+
+
+class AssetService:
+    """A bounded pool of workers that produce asset files in the background.
+
+    Files are produced once per filename, no matter how many times they're submitted, so
+    anything that knows where a file will end up can ask for it.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.futures: Dict[str, concurrent.futures.Future] = dict()
+        self.lock = threading.Lock()
+
+    def submit(self, filename: str, produce: Callable[..., None], *args) -> concurrent.futures.Future:
+        """Calls produce(*args) on a worker unless filename was already submitted, and returns
+        the future for filename either way.
+        """
+        with self.lock:
+            future = self.futures.get(filename)
+            if future is None:
+                future = self.executor.submit(produce, *args)
+                self.futures[filename] = future
+            return future
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+class LinkedAsset(NamedTuple):
+    path: str
+    future: concurrent.futures.Future
+    # what the file is made from, like an image URL or LaTeX source, for error messages
+    source: str
+    # markup the link replaced, which goes back in its place if the file never turns up
+    fallback: str
+
+
+class AssetLinks:
+    """Every file the output links to, with the future that produces it.
+
+    Links are added as soon as a file is planned, before it exists, so passes never wait on
+    assets. check is the barrier at the end that makes sure they all turned up.
+    """
+
+    def __init__(self):
+        self.assets: Dict[str, LinkedAsset] = dict()
+        self.lock = threading.Lock()
+
+    def add(self, path: str, future: concurrent.futures.Future, source: str, fallback: str) -> str:
+        """Records that the output links to path, and returns the href to link to it with.
+        """
+        with self.lock:
+            self.assets.setdefault(path, LinkedAsset(path, future, source, fallback))
+        return 'file://' + path
+
+    def check(self) -> List[Tuple[LinkedAsset, Optional[BaseException]]]:
+        """Waits for every linked file, and returns the ones that don't exist along with the
+        error that stopped each from being produced, if there was one.
+        """
+        missing = []
+        for asset in self.assets.values():
+            error = asset.future.exception()
+            if error is not None or not os.path.isfile(asset.path):
+                missing.append((asset, error))
+        return missing
+
+
+def restore_missing_links(text: str, missing: Dict[str, LinkedAsset]) -> str:
+    """Puts the fallback of each asset in missing, keyed by path, back in place of the links to
+    it in the output text, so a formula that didn't compile shows up as its source again.
+    """
+    if not missing:
+        return text
+
+    def restore(match: re.Match) -> str:
+        asset = missing.get(html.unescape(match[1]))
+        return match[0] if asset is None else asset.fallback
+
+    return LINK_TAG_REGEX.sub(restore, text)
+
+
+_download_service: Optional[AssetService] = None
+_links: Optional[AssetLinks] = None
+_lock = threading.Lock()
+
+
+def get_download_service() -> AssetService:
+    global _download_service
+    with _lock:
+        if _download_service is None:
+            _download_service = AssetService(DOWNLOAD_WORKERS, 'download')
+        return _download_service
+
+
+def shutdown_download_service():
+    global _download_service
+    with _lock:
+        if _download_service is not None:
+            _download_service.shutdown()
+            _download_service = None
+
+
+def get_links() -> AssetLinks:
+    global _links
+    with _lock:
+        if _links is None:
+            _links = AssetLinks()
+        return _links
+
+
+def take_links() -> AssetLinks:
+    """Returns every link added so far, and starts over for the next export.
+    """
+    global _links
+    with _lock:
+        links = _links if _links is not None else AssetLinks()
+        _links = None
+        return links
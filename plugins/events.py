@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TextIO
+
+Event = Dict[str, Any]
+Listener = Callable[[Event], None]
+
+FD_PREFIX = 'fd:'
+
+_listeners: List[Listener] = []
+# Events come from LaTeX workers too, so listeners are called one event at a time
+_lock = threading.Lock()
+
+
+def add_listener(listener: Listener):
+    with _lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: Listener):
+    with _lock:
+        _listeners.remove(listener)
+
+
+def is_enabled() -> bool:
+    """Returns True if anything is listening, so callers can skip measuring things nobody will see.
+    """
+    return bool(_listeners)
+
+
+def emit(event: str, **fields):
+    """Sends the event with the given fields to every listener, stamped with the current time.
+    """
+    if not _listeners:
+        return
+    record: Event = {'time': time.time(), 'event': event, **fields}
+    with _lock:
+        for listener in _listeners:
+            listener(record)
+
+
+def open_event_file(target: str) -> TextIO:
+    """Opens target to write events to. target is a path, or fd:N for a file descriptor that's already open.
+    """
+    if target.startswith(FD_PREFIX):
+        return open(int(target[len(FD_PREFIX):]), 'w', encoding='utf-8', closefd=False)
+    return open(target, 'w', encoding='utf-8')
+
+
+class JsonLinesWriter:
+    """Writes every event to file as a line of JSON, as soon as it happens.
+    """
+
+    def __init__(self, file: TextIO):
+        self.file = file
+
+    def __call__(self, event: Event):
+        self.file.write(json.dumps(event, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f'{minutes}m{seconds:02}s' if minutes else f'{seconds}s'
+
+
+class ProgressSummary:
+    """Prints a line about how far along the export is after every article, with an estimate of
+    how long the rest will take based on the articles so far.
+    """
+
+    def __init__(self, print_line: Callable[[str], None] = None):
+        self.print_line = print_line or (lambda line: print(line, flush=True))
+        self.total = 0
+        self.done = 0
+        self.started: Optional[float] = None
+        self.bytes_downloaded = 0
+        self.formulas = 0
+        self.failed_formulas = 0
+        self.latex_seconds = 0.0
+
+    def __call__(self, event: Event):
+        kind = event['event']
+        if kind == 'export_start':
+            self.total = event['articles']
+            self.started = event['time']
+        elif kind in ('download', 'embed_fetch'):
+            self.bytes_downloaded += event.get('bytes', 0)
+        elif kind == 'latex_compile':
+            if event['ok']:
+                self.formulas += 1
+            else:
+                self.failed_formulas += 1
+            self.latex_seconds += event['seconds']
+        elif kind == 'article_finish':
+            self.done += 1
+            self.print_line(self.summarize(event['time']))
+
+    def get_eta(self, now: float) -> Optional[float]:
+        if self.started is None or not self.done:
+            return None
+        return (now - self.started) / self.done * (self.total - self.done)
+
+    def summarize(self, now: float) -> str:
+        elapsed = now - self.started if self.started is not None else 0.0
+        eta = self.get_eta(now)
+        return (f'[{self.done}/{self.total} articles] {format_duration(elapsed)} elapsed, '
+            f'ETA {format_duration(eta) if eta is not None else "?"}, '
+            f'{self.bytes_downloaded / 1e6:.1f} MB downloaded, '
+            f'{self.formulas} formulas compiled'
+            + (f', {self.failed_formulas} failed' if self.failed_formulas else '')
+            + f' in {self.latex_seconds:.1f}s')
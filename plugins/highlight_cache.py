@@ -0,0 +1,138 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+import os.path
+from typing import Dict, Optional, OrderedDict, Union
+
+import pygments
+
+from plugins import preformatted
+from plugins.syntax_highlighting import IndFormatter
+from util import CACHE_DIR
+
+# Where formatted code blocks are kept between runs
+HIGHLIGHT_CACHE_DIR = os.path.join(CACHE_DIR, 'highlight')
+# Keep formatted code blocks between runs, so unchanged ones aren't highlighted and wrapped again
+USE_HIGHLIGHT_CACHE = True
+# Bytes of formatted code blocks to keep before the least recently used are thrown out
+HIGHLIGHT_CACHE_SIZE = 64 * 1024 * 1024
+# Bump this whenever code blocks come out differently for reasons the cache key can't see,
+# like changes to how lines are wrapped
+HIGHLIGHT_CACHE_VERSION = 1
+CACHE_ENTRY_SUFFIX = '.html'
+
+
+@functools.lru_cache()
+def get_style_fingerprint(style: str) -> str:
+    """Returns a hash of the tags IndFormatter wraps each token type of style in, so cached
+    blocks are thrown out whenever the style mapping changes.
+    """
+    styles = IndFormatter(style=style).styles
+    mapping = sorted((str(token), start, end) for token, (start, end) in styles.items())
+    return hashlib.sha1(json.dumps(mapping).encode('utf-8')).hexdigest()
+
+
+def get_cache_key(pre_contents: str, options: Dict[str, Union[str, bool]]) -> str:
+    """Returns the key of the formatted code block pre_contents, with options parsed from its options block.
+    """
+    key = json.dumps([
+        HIGHLIGHT_CACHE_VERSION,
+        pygments.__version__,
+        get_style_fingerprint(preformatted.HIGHLIGHT_STYLE),
+        preformatted.MAX_PRE_LINE_LENGTH,
+        sorted(options.items()),
+        hashlib.sha256(pre_contents.encode('utf-8')).hexdigest(),
+    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class HighlightCache:
+    """Formatted code blocks on disk, one file per block, bounded to max_size bytes.
+
+    The least recently used blocks are evicted first. Files are touched when they're read, so
+    the order carries over between runs.
+    """
+
+    def __init__(self, cache_dir: str = HIGHLIGHT_CACHE_DIR, max_size: int = HIGHLIGHT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # key -> size in bytes, least recently used first
+        self.entries: Optional[OrderedDict[str, int]] = None
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_ENTRY_SUFFIX)
+
+    def load_entries(self) -> OrderedDict[str, int]:
+        """Lists what's in the cache directory the first time it's needed.
+        """
+        if self.entries is None:
+            found = []
+            if os.path.isdir(self.cache_dir):
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith(CACHE_ENTRY_SUFFIX):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name[:-len(CACHE_ENTRY_SUFFIX)], stat.st_size))
+            found.sort()
+            self.entries = collections.OrderedDict((key, size) for _, key, size in found)
+            self.total_size = sum(self.entries.values())
+        return self.entries
+
+    def get(self, key: str) -> Optional[str]:
+        entries = self.load_entries()
+        if key in entries:
+            try:
+                with open(self.get_path(key), encoding='utf-8', newline='') as cache_file:
+                    markup = cache_file.read()
+                os.utime(self.get_path(key))
+                entries.move_to_end(key)
+                self.hits += 1
+                return markup
+            except OSError:
+                # someone else evicted it
+                self.total_size -= entries.pop(key)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, markup: str):
+        entries = self.load_entries()
+        data = markup.encode('utf-8')
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # written under another name first, so other runs never read half a block
+            with open(self.get_path(key) + '.tmp', 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(self.get_path(key) + '.tmp', self.get_path(key))
+        except OSError as e:
+            print(f'Could not cache code block. Reason: {e}')
+            return
+        self.total_size += len(data) - entries.pop(key, 0)
+        entries[key] = len(data)
+        self.evict()
+
+    def evict(self):
+        while self.total_size > self.max_size and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_size -= size
+            try:
+                os.remove(self.get_path(key))
+            except OSError:
+                pass
+
+
+_cache: Optional[HighlightCache] = None
+
+
+def get_cache() -> Optional[HighlightCache]:
+    """Returns the cache of formatted code blocks, or None if USE_HIGHLIGHT_CACHE is off.
+    """
+    global _cache
+    if not USE_HIGHLIGHT_CACHE:
+        return None
+    if _cache is None:
+        _cache = HighlightCache()
+    return _cache
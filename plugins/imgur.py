@@ -0,0 +1,140 @@
+import asyncio
+import codecs
+import http.client
+import re
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from html.parser import HTMLParser
+from typing import Dict, Iterable, Tuple, Union
+
+from plugins.events import emit
+
+IMGUR_URL_REGEX = re.compile(r'''
+(?:https?:)?//
+(?:i\.)?                  # Don't care if the URL uses the i.imgur.com subdomain
+imgur.com/
+(?P<scheme>a/|gallery/)?  # Don't care about URL scheme
+(?P<hash>\w{5}(?:\w\w)*)  # Match the gallery hash, which will be an odd number of characters
+.?                        # Don't care about any extraneous characters
+(?P<ext>\.\w+)?           # Match any potential file extensions
+''', re.VERBOSE | re.ASCII)
+IMGUR_EMBED_REGEX = re.compile(rf'''\[embed\]{IMGUR_URL_REGEX.pattern}\[/embed\]''', re.VERBOSE | re.ASCII)
+IMGUR_IMAGE_URL_TEMPL = 'https://i.imgur.com/{hash}{ext}'
+# The page we scrape to find the image of an extensionless embed. Tests point this at a local server.
+IMGUR_EMBED_URL_TEMPL = 'https://imgur.com/{scheme}{hash}/embed?pub=true'
+
+# Maximum number of embed pages fetched at once from a single host
+MAX_CONNECTIONS_PER_HOST = 4
+# Seconds to wait on an embed page before giving up on it
+EMBED_TIMEOUT = 30
+# Embed pages are read and parsed in chunks of this many bytes, so we can stop as soon as we see the image
+EMBED_READ_SIZE = 8192
+
+# (scheme, hash) pair identifying an Imgur gallery
+EmbedKey = Tuple[str, str]
+
+# Elements that never have a closing tag, and so never change the nesting depth
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+}
+
+
+def get_embed_key(match: re.Match) -> EmbedKey:
+    return match['scheme'] or '', match['hash']
+
+
+class EmbedImageParser(HTMLParser):
+    """Finds the source of the first <img class="post"> inside the element with id="image".
+    Only tracks the nesting depth inside that element instead of building a tree.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.found_container = False
+        self.src = None
+        # depth of nesting inside #image, 0 if we aren't in it
+        self.depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self.src is not None:
+            return
+        attrs = dict(attrs)
+        if self.depth:
+            if tag == 'img' and 'post' in (attrs.get('class') or '').split():
+                self.src = attrs.get('src')
+            elif tag not in VOID_ELEMENTS:
+                self.depth += 1
+        elif not self.found_container and attrs.get('id') == 'image':
+            self.found_container = True
+            self.depth = 0 if tag in VOID_ELEMENTS else 1
+
+    def handle_startendtag(self, tag, attrs):
+        # self-closing tags don't open a new level
+        depth = self.depth
+        self.handle_starttag(tag, attrs)
+        self.depth = min(self.depth, depth)
+
+    def handle_endtag(self, tag):
+        if self.depth and tag not in VOID_ELEMENTS:
+            self.depth -= 1
+
+
+def fetch_embed_image(key: EmbedKey) -> str:
+    """Fetches the embed page of the gallery given by key and returns the URL of its first image.
+    Raises ValueError if the page doesn't have one.
+    """
+    scheme, img_hash = key
+    embed_url = IMGUR_EMBED_URL_TEMPL.format(scheme=scheme, hash=img_hash)
+    parser = EmbedImageParser()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    start = time.perf_counter()
+    bytes_read = 0
+    with urllib.request.urlopen(embed_url, timeout=EMBED_TIMEOUT) as resp:
+        if resp.getcode() != 200:
+            raise ValueError('Gallery does not exist')
+        # Stop reading as soon as the image turns up, the rest of the page is of no use to us
+        while parser.src is None:
+            chunk = resp.read(EMBED_READ_SIZE)
+            bytes_read += len(chunk)
+            parser.feed(decoder.decode(chunk, final=not chunk))
+            if not chunk:
+                break
+    emit('embed_fetch', url=embed_url, bytes=bytes_read, seconds=time.perf_counter() - start)
+    if parser.src is None:
+        raise ValueError('Could not find image source in returned webpage')
+    # Filter url given in content
+    img_match = IMGUR_URL_REGEX.match(parser.src)
+    if img_match is None:
+        raise ValueError(f'Unrecognized image source {parser.src}')
+    return IMGUR_IMAGE_URL_TEMPL.format(**img_match.groupdict(default=''))
+
+
+async def resolve_embeds_async(keys: Iterable[EmbedKey]) -> Dict[EmbedKey, Union[str, Exception]]:
+    """Resolves every gallery in keys concurrently, with at most MAX_CONNECTIONS_PER_HOST
+    requests in flight to any one host. Failures are returned in place of the URL.
+    """
+    loop = asyncio.get_event_loop()
+    host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def resolve(key: EmbedKey) -> Union[str, Exception]:
+        host = urllib.parse.urlparse(IMGUR_EMBED_URL_TEMPL.format(scheme=key[0], hash=key[1])).netloc
+        semaphore = host_semaphores.setdefault(host, asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST))
+        async with semaphore:
+            try:
+                return await loop.run_in_executor(None, fetch_embed_image, key)
+            except (urllib.error.URLError, http.client.HTTPException, ValueError, OSError) as e:
+                return e
+
+    keys = list(dict.fromkeys(keys))
+    results = await asyncio.gather(*(resolve(key) for key in keys))
+    return dict(zip(keys, results))
+
+
+def resolve_embeds(keys: Iterable[EmbedKey]) -> Dict[EmbedKey, Union[str, Exception]]:
+    keys = list(keys)
+    if not keys:
+        return {}
+    return asyncio.run(resolve_embeds_async(keys))
@@ -0,0 +1,107 @@
+import enum
+import re
+from typing import Any, Iterable, List, Pattern, Union
+
+from plugins.imgur import IMGUR_EMBED_REGEX
+
+class InlineTokenType(enum.Enum):
+    Embed = 'embed'
+    Math = 'math'
+    Code = 'code'
+    Footnote = 'footnote'
+
+INLINE_PATTERNS = {
+    # [embed]https://imgur.com/...[/embed]
+    InlineTokenType.Embed: IMGUR_EMBED_REGEX,
+    # LaTeX inside \( \) or \[ \]
+    InlineTokenType.Math: re.compile(r'\\[([]([\s\S]+?)\\[)\]]'),
+    # Markdown-style `code`
+    InlineTokenType.Code: re.compile(r'`([\s\S]+?)`'),
+    # [1], [2], ... or [] for automatic numbering
+    InlineTokenType.Footnote: re.compile(r'\[(\d*)\]'),
+}
+
+# When markup overlaps, types earlier in this list win over later ones. A later type can
+# never match across or inside an earlier one, just like when each ran as its own pass.
+INLINE_PRECEDENCE = [
+    InlineTokenType.Embed,
+    InlineTokenType.Math,
+    InlineTokenType.Code,
+    InlineTokenType.Footnote,
+]
+
+# Inline flag letters for each regex flag, so patterns with different flags can share one regex
+_FLAG_LETTERS = (
+    (re.ASCII, 'a'),
+    (re.IGNORECASE, 'i'),
+    (re.MULTILINE, 'm'),
+    (re.DOTALL, 's'),
+    (re.VERBOSE, 'x'),
+)
+
+class InlineToken:
+    __slots__ = ('type', 'match')
+
+    def __init__(self, token_type: InlineTokenType, match: re.Match):
+        self.type = token_type
+        self.match = match
+
+    @property
+    def text(self) -> str:
+        return self.match[0]
+
+    def __repr__(self):
+        return f'InlineToken({self.type}, {self.text!r})'
+
+def combine_patterns(patterns: Iterable[Pattern]) -> Pattern:
+    """Joins patterns into one alternation, keeping the flags of each.
+    """
+    alternatives = []
+    for pattern in patterns:
+        flags = ''.join(letter for flag, letter in _FLAG_LETTERS if pattern.flags & flag)
+        alternatives.append(f'(?{flags}:{pattern.pattern})' if flags else f'(?:{pattern.pattern})')
+    return re.compile('|'.join(alternatives))
+
+Piece = Union[str, InlineToken, Any]
+
+class InlineTokenizer:
+    """Splits text into plain strings and typed tokens of inline markup.
+    """
+
+    def __init__(self, token_types: Iterable[InlineTokenType]):
+        token_types = set(token_types)
+        self.token_types = [token_type for token_type in INLINE_PRECEDENCE if token_type in token_types]
+        # One scan with this tells us whether there's anything to tokenize at all, which there usually isn't
+        self.combined = combine_patterns(INLINE_PATTERNS[token_type] for token_type in self.token_types)
+
+    def has_markup(self, text: str) -> bool:
+        return self.combined.search(text) is not None
+
+    def split(self, pieces: List[Piece], token_type: InlineTokenType) -> List[Piece]:
+        """Splits the string pieces of pieces around markup of token_type. Anything that isn't a
+        string is left alone, so markup can't match across it. Strings are kept on both sides of
+        every token, even if they are empty.
+        """
+        pattern = INLINE_PATTERNS[token_type]
+        split_pieces: List[Piece] = []
+        for piece in pieces:
+            if not isinstance(piece, str):
+                split_pieces.append(piece)
+                continue
+            last_end = -1
+            for match in pattern.finditer(piece):
+                split_pieces.append(piece[max(last_end, 0):match.start()])
+                split_pieces.append(InlineToken(token_type, match))
+                last_end = match.end()
+            split_pieces.append(piece if last_end == -1 else piece[last_end:])
+        return split_pieces
+
+    def tokenize(self, text: str) -> List[Piece]:
+        """Returns the pieces of text in order, with each type of markup claimed in order of precedence.
+        """
+        pieces: List[Piece] = [text]
+        if not self.has_markup(text):
+            return pieces
+        for token_type in self.token_types:
+            pieces = self.split(pieces, token_type)
+        return pieces
@@ -0,0 +1,198 @@
+import concurrent.futures
+import hashlib
+import os
+import os.path
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pylatex
+
+from plugins.assets import AssetService
+from plugins.events import emit
+from util import CACHE_DIR
+
+# Where precompiled formats are kept between runs
+FORMAT_DIR = os.path.join(CACHE_DIR, 'latex')
+# Compile formulas against a precompiled format of the shared preamble. Falls back to a
+# full compile if the format can't be built.
+USE_PRECOMPILED_FORMAT = True
+LATEX_COMPILER = 'pdflatex'
+# Number of formulas compiled at once
+LATEX_WORKERS = os.cpu_count() or 1
+# Seconds a single compile may take before we give up on it
+COMPILE_TIMEOUT = 60
+
+BEGIN_DOCUMENT = r'\begin{document}'
+
+# Preamble hash -> format name, or None if the format couldn't be built
+_formats: Dict[str, Optional[str]] = dict()
+_compiler_version: Optional[str] = None
+# Formats are shared by every worker, so only one of them should build each format
+_format_lock = threading.Lock()
+
+
+class Preview(pylatex.base_classes.Environment):
+    packages = [pylatex.Package('preview', ['active', 'tightpage', 'pdftex'])]
+    escape = False
+    content_separator = "\n"
+
+
+def make_document(latex: str, display: bool = False) -> pylatex.Document:
+    """Creates a document that renders only the formula latex.
+    """
+    document = pylatex.Document()
+    document.packages.append(pylatex.Package('amsmath'))
+    document.packages.append(pylatex.Package('amssymb'))
+    document.packages.append(pylatex.Package('amsfonts'))
+    document.preamble.append(pylatex.Command('thispagestyle', 'empty'))
+    # People seem to think \Z, \R and \Q exist, even though they don't. Just add them in to avoid problems.
+    document.preamble.append(pylatex.NoEscape(r'\newcommand{\Z}{\mathbb{Z}}'))
+    document.preamble.append(pylatex.NoEscape(r'\newcommand{\R}{\mathbb{R}}'))
+    document.preamble.append(pylatex.NoEscape(r'\newcommand{\Q}{\mathbb{Q}}'))
+    with document.create(Preview()):
+        document.append(pylatex.NoEscape((r'\[' if display else r'\(') + latex + (r'\]' if display else r'\)')))
+    return document
+
+
+def split_document(document: pylatex.Document) -> Tuple[str, str]:
+    """Splits the source of document into its preamble and its body, starting at \\begin{document}.
+    """
+    source = document.dumps()
+    split_at = source.index(BEGIN_DOCUMENT)
+    return source[:split_at], source[split_at:]
+
+
+def get_compiler_version() -> str:
+    """Formats only load in the exact TeX build that dumped them, so the version is part of the cache key.
+    """
+    global _compiler_version
+    if _compiler_version is None:
+        output = subprocess.run([LATEX_COMPILER, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True).stdout
+        _compiler_version = output.decode(errors='replace').split('\n', 1)[0]
+    return _compiler_version
+
+
+def get_format_env() -> Dict[str, str]:
+    # The trailing separator keeps the default search path after our own directory
+    env = dict(os.environ)
+    env['TEXFORMATS'] = FORMAT_DIR + os.pathsep + env.get('TEXFORMATS', '')
+    return env
+
+
+def build_format(preamble: str, format_name: str):
+    """Dumps preamble into FORMAT_DIR/format_name.fmt with pdflatex -ini.
+    """
+    with tempfile.TemporaryDirectory() as build_dir:
+        with open(os.path.join(build_dir, format_name + '.tex'), 'w', encoding='utf-8') as tex_file:
+            tex_file.write(preamble + '\\dump\n')
+        subprocess.run(
+            [LATEX_COMPILER, '-ini', '-interaction=nonstopmode', '-halt-on-error',
+                f'-jobname={format_name}', f'&{LATEX_COMPILER}', format_name + '.tex'],
+            cwd=build_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=COMPILE_TIMEOUT, check=True)
+        os.makedirs(FORMAT_DIR, exist_ok=True)
+        shutil.move(os.path.join(build_dir, format_name + '.fmt'), os.path.join(FORMAT_DIR, format_name + '.fmt'))
+
+
+def get_format(preamble: str) -> Optional[str]:
+    """Returns the name of the precompiled format for preamble, building it if it isn't cached.
+    Returns None if the format couldn't be built.
+    """
+    preamble_hash = hashlib.sha1(preamble.encode('utf-8')).hexdigest()
+    with _format_lock:
+        if preamble_hash not in _formats:
+            _formats[preamble_hash] = load_format(preamble)
+        return _formats[preamble_hash]
+
+
+def load_format(preamble: str) -> Optional[str]:
+    format_name = None
+    try:
+        key = hashlib.sha1((get_compiler_version() + '\n' + preamble).encode('utf-8')).hexdigest()
+        format_name = 'prepress-' + key[:16]
+        cached = os.path.isfile(os.path.join(FORMAT_DIR, format_name + '.fmt'))
+        start = time.perf_counter()
+        if not cached:
+            print(f'Building LaTeX format {format_name}', flush=True)
+            build_format(preamble, format_name)
+        emit('latex_format', name=format_name, cached=cached, seconds=time.perf_counter() - start)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f'Could not build LaTeX format, compiling formulas without it. Reason: {e}')
+        format_name = None
+    return format_name
+
+
+def run_compiler(source: str, filename: str, compiler_args: List[str] = None, env: Dict[str, str] = None):
+    """Compiles the LaTeX source in a scratch directory and saves the PDF to filename.
+    Raises subprocess.TimeoutExpired if it takes longer than COMPILE_TIMEOUT.
+    """
+    jobname = os.path.basename(filename)
+    with tempfile.TemporaryDirectory() as build_dir:
+        with open(os.path.join(build_dir, jobname + '.tex'), 'w', encoding='utf-8') as tex_file:
+            tex_file.write(source)
+        try:
+            subprocess.run(
+                [LATEX_COMPILER, '-interaction=nonstopmode', '-halt-on-error'] + (compiler_args or []) + [jobname + '.tex'],
+                cwd=build_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                timeout=COMPILE_TIMEOUT, check=True)
+        except subprocess.CalledProcessError as e:
+            print(e.output.decode(errors='replace'))
+            raise
+        shutil.move(os.path.join(build_dir, jobname + '.pdf'), os.path.abspath(filename) + '.pdf')
+
+
+def compile_latex_str(latex: str, filename: str, display: bool = False, use_format: bool = None):
+    """Compiles the string latex into a PDF, and saves it to filename.
+    """
+    if use_format is None:
+        use_format = USE_PRECOMPILED_FORMAT
+    document = make_document(latex, display)
+    preamble, body = split_document(document)
+    format_name = get_format(preamble) if use_format else None
+    start = time.perf_counter()
+    try:
+        if format_name is not None:
+            run_compiler(body, filename, [f'-fmt={format_name}'], get_format_env())
+        else:
+            run_compiler(preamble + body, filename)
+    except Exception as e:
+        emit('latex_compile', filename=filename, seconds=time.perf_counter() - start, ok=False, error=str(e))
+        raise
+    emit('latex_compile', filename=filename, seconds=time.perf_counter() - start, ok=True)
+    print(f"{filename}\t{latex}", flush=True)
+
+
+class LatexCompileService(AssetService):
+    """Compiles formulas on a bounded pool of workers in the background.
+
+    Every article submits its formulas to the same queue, and gets back futures it can wait on.
+    """
+
+    def __init__(self, max_workers: int = None):
+        super().__init__(max_workers or LATEX_WORKERS, 'latex')
+
+    def submit(self, latex: str, filename: str, display: bool = False) -> concurrent.futures.Future:
+        return super().submit(filename, compile_latex_str, latex, filename, display)
+
+
+_service: Optional[LatexCompileService] = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> LatexCompileService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = LatexCompileService()
+        return _service
+
+
+def shutdown_service():
+    global _service
+    with _service_lock:
+        if _service is not None:
+            _service.shutdown()
+            _service = None
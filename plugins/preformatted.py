@@ -1,32 +1,59 @@
-from typing import Dict, Union
+import html
+import io
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 
 import bs4
 import pygments as pyg
-from pygments import lexers, util
+from pygments import lexer, lexers, util
 
-from util import LINE_SEPARATOR
+from util import LINE_SEPARATOR, html_escape
 from plugins.syntax_highlighting import IndFormatter
 
 Options = Dict[str, Union[str, bool]]
 
 # Maximum length of a line in a code block
 MAX_PRE_LINE_LENGTH = 48
+# Pygments style IndFormatter turns into bold, italic and underlined tags
+HIGHLIGHT_STYLE = 'bw'
+# Code blocks longer than this many characters are formatted a line at a time, see format_code_block_lines
+STREAMING_PRE_LENGTH = 20000
 
+LINENO_START_TAG = 'mathnews-pre--lineno-start'
+LINENO_TAG = 'mathnews-pre--lineno'
+# Use RIGHTWARDS ARROW WITH HOOK (↪, U+21AA) to signify line continuation
+LINE_CONTINUATION_MARKUP = '<mathnews-pre--ruby>\u21aa</mathnews-pre--ruby>'
+# Use OPEN BOX (␣, U+2423) to signify space
+SPACE_SYMBOL_MARKUP = '<mathnews-pre--ruby>\u2423</mathnews-pre--ruby>'
+# Tags, comments and CDATA sections in the markup of a code block
+MARKUP_TAG_REGEX = re.compile(r'<!--[\s\S]*?-->|<!\[CDATA\[[\s\S]*?\]\]>|<[^>]*>')
 
-def highlight_code(pre_contents: str, options: Options) -> str:
-    """ Add syntax highlighting to a code block
+
+def get_lexer(options: Options) -> Optional[pyg.lexer.Lexer]:
+    """Returns the lexer for the language of a code block, or None if there isn't one.
     """
-    # Find lexer for the given language
     lang_name = options.get('language', options.get('lang', None))  # allow for language or lang options
     try:
-        lexer = pyg.lexers.get_lexer_by_name(lang_name)
+        return pyg.lexers.get_lexer_by_name(lang_name)
     except pyg.util.ClassNotFound:
+        return None
+
+
+def get_code_text(pre_contents: str) -> str:
+    return bs4.BeautifulSoup(pre_contents, 'html.parser').get_text().strip()
+
+
+def highlight_code(pre_contents: str, options: Options) -> str:
+    """ Add syntax highlighting to a code block
+    """
+    # Find lexer for the given language
+    lexer = get_lexer(options)
+    if lexer is None:
         return pre_contents
 
     # Highlight the code
-    formatter = IndFormatter(style='bw')
-    pre_text = bs4.BeautifulSoup(pre_contents, 'html.parser').get_text().strip()
-    pre_text = pyg.highlight(pre_text, lexer, formatter)
+    formatter = IndFormatter(style=HIGHLIGHT_STYLE)
+    pre_text = pyg.highlight(get_code_text(pre_contents), lexer, formatter)
     # Strip ending whitespace
     return pre_text.rstrip()
 
@@ -36,10 +63,10 @@ def add_linenos(pre_contents: str, options: Options) -> str:
     """
     if options.get('linenos', False):
         first_line, *rest = pre_contents.split('\n')
-        pre_contents = f'<mathnews-pre--lineno-start>{first_line}</mathnews-pre--lineno-start>'
+        pre_contents = f'<{LINENO_START_TAG}>{first_line}</{LINENO_START_TAG}>'
         if rest:
             rest_joined = '\n'.join(rest)
-            pre_contents += f'\n<mathnews-pre--lineno>{rest_joined}</mathnews-pre--lineno>'
+            pre_contents += f'\n<{LINENO_TAG}>{rest_joined}</{LINENO_TAG}>'
 
     return pre_contents
 
@@ -90,6 +117,20 @@ def find_best_break(line: str, offset: int, break_estimate: int) -> int:
     return break_at
 
 
+def get_line_breaks(line: str) -> Iterator[int]:
+    """Yields the offsets in line, which has no newlines, at which it should be wrapped
+    """
+    cur_line_start = 0
+    line_len = len(line)
+    max_len_offset = 0  # Leave space for the line continuation character
+    while line_len - cur_line_start > MAX_PRE_LINE_LENGTH - max_len_offset:
+        # find a break point
+        split_at = find_best_break(line, cur_line_start, MAX_PRE_LINE_LENGTH - max_len_offset)
+        cur_line_start += split_at
+        yield cur_line_start
+        max_len_offset = 1  # one less column due to line continuation character
+
+
 def wrap_lines(pre_tag: bs4.Tag) -> bs4.Tag:
     # Insert line-wraps
     # Our first step is to create a changeset for the plaintext version
@@ -98,17 +139,8 @@ def wrap_lines(pre_tag: bs4.Tag) -> bs4.Tag:
     changeset = []
     running_offset = 0
     for line in pre_lines:
-        cur_line_start = 0
-        line_len = len(line)
-        max_len_offset = 0  # Leave space for the line continuation character
-        while line_len - cur_line_start > MAX_PRE_LINE_LENGTH - max_len_offset:
-            # find a break point
-            split_at = find_best_break(line, cur_line_start, MAX_PRE_LINE_LENGTH - max_len_offset)
-            cur_line_start += split_at
-            changeset.append(running_offset + cur_line_start)
-            max_len_offset = 1  # one less column due to line continuation character
-
-        running_offset += line_len + 1  # add one for newline character
+        changeset.extend(running_offset + break_at for break_at in get_line_breaks(line))
+        running_offset += len(line) + 1  # add one for newline character
 
     # Next, we match up the offsets of each text tag in the plaintext
     text_tags = pre_tag.find_all(text=True)
@@ -168,3 +200,234 @@ def wrap_lines(pre_tag: bs4.Tag) -> bs4.Tag:
         cur_tag.replace_with(*reversed(sub_tags))
 
     return pre_tag
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Like text.split('\\n'), but lazy, and keeping the newlines.
+    """
+    return split_lines([text])
+
+
+def split_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """iter_lines, for text that comes in chunks. Only the current line is held.
+    """
+    line: List[str] = []
+    for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find('\n', start)
+            if end == -1:
+                line.append(chunk[start:])
+                break
+            line.append(chunk[start:end + 1])
+            yield ''.join(line)
+            line = []
+            start = end + 1
+    yield ''.join(line)
+
+
+def rstrip_chunks(chunks: Iterable[str]) -> Iterator[str]:
+    """Like ''.join(chunks).rstrip(), in chunks. Whitespace is held back until something follows it.
+    """
+    held = ''
+    for chunk in chunks:
+        body = chunk.rstrip()
+        if body:
+            yield held + body
+            held = chunk[len(body):]
+        else:
+            held += chunk
+
+
+def iter_highlighted_lines(pre_contents: str, options: Options) -> Iterator[str]:
+    """highlight_code, for markup that comes in lines like from iter_lines. Tokens are formatted
+    as the lexer finds them, so the highlighted block is never held in one piece.
+    """
+    lexer = get_lexer(options)
+    if lexer is None:
+        return iter_lines(pre_contents)
+    formatter = IndFormatter(style=HIGHLIGHT_STYLE)
+    return split_lines(rstrip_chunks(formatter.iter_markup(pyg.lex(get_code_text(pre_contents), lexer))))
+
+
+def number_lines(lines: Iterable[str], options: Options) -> Iterator[str]:
+    """add_linenos, for markup that comes in lines from iter_lines
+    """
+    if not options.get('linenos', False):
+        yield from lines
+        return
+    lines = iter(lines)
+    first_line = next(lines)
+    if not first_line.endswith('\n'):
+        yield f'<{LINENO_START_TAG}>{first_line}</{LINENO_START_TAG}>'
+        return
+    yield f'<{LINENO_START_TAG}>{first_line[:-1]}</{LINENO_START_TAG}>\n<{LINENO_TAG}>'
+    yield from lines
+    yield f'</{LINENO_TAG}>'
+
+
+class TextRun:
+    """A run of text between two tags, which becomes one text node once parsed.
+    """
+    __slots__ = ('length', 'has_breaks')
+
+    def __init__(self):
+        self.length = 0
+        self.has_breaks = False
+
+
+# A piece of output: either text belonging to a run, which is escaped on the way out, or markup with no run
+OutputEntry = List[Union[str, Optional[TextRun]]]
+
+
+class LineWrapper:
+    """Wraps the markup of a code block the same way wrap_lines does, but a line at a time,
+    on the markup itself rather than a parsed tree.
+
+    Markup goes in a line at a time through feed(), and the wrapped markup comes back out of
+    feed() and close(). Only the current line is kept around, along with the end of the text
+    before it, which a break at the start of the next run of text can still trim.
+    """
+
+    def __init__(self):
+        # An unfinished tag at the end of the last line
+        self.carry = ''
+        # (text, run, starts run) for text in the current line, and (markup, None, False) for tags
+        self.line_items: List[tuple] = []
+        self.line_text: List[str] = []
+        # The run the next text belongs to, or None if there was a tag since the last text
+        self.run: Optional[TextRun] = None
+        self.pending: List[OutputEntry] = []
+
+    def feed(self, markup: str) -> str:
+        markup = self.carry + markup
+        self.carry = ''
+        pos = 0
+        while pos < len(markup):
+            tag_start = markup.find('<', pos)
+            if tag_start == -1:
+                self.add_text(html.unescape(markup[pos:]))
+                break
+            if tag_start > pos:
+                self.add_text(html.unescape(markup[pos:tag_start]))
+            tag = MARKUP_TAG_REGEX.match(markup, tag_start)
+            if tag is None:
+                self.carry = markup[tag_start:]
+                break
+            self.add_tag(tag[0])
+            pos = tag.end()
+        return self.flush(self.get_flush_point())
+
+    def close(self) -> str:
+        if self.carry:
+            self.add_text(html.unescape(self.carry))
+            self.carry = ''
+        self.end_line()
+        return self.flush(len(self.pending))
+
+    def add_tag(self, markup: str):
+        self.run = None
+        self.line_items.append((markup, None, False))
+
+    def add_text(self, text: str):
+        start = 0
+        while start < len(text):
+            end = text.find('\n', start)
+            piece = text[start:] if end == -1 else text[start:end + 1]
+            starts_run = self.run is None
+            if starts_run:
+                self.run = TextRun()
+            self.run.length += len(piece)
+            self.line_items.append((piece, self.run, starts_run))
+            self.line_text.append(piece)
+            if end == -1:
+                break
+            self.end_line()
+            start = end + 1
+
+    def end_line(self):
+        """Wraps the finished line and moves it to the pending output.
+        """
+        line = ''.join(self.line_text)
+        breaks = get_line_breaks(line[:-1] if line.endswith('\n') else line)
+        next_break = next(breaks, None)
+        offset = 0
+        for item, run, starts_run in self.line_items:
+            if run is None:
+                self.pending.append([item, None])
+                continue
+            item_start = offset
+            offset += len(item)
+            cursor = 0
+            while next_break is not None and next_break < offset:
+                change_offset = next_break - item_start
+                # Replace the space at the end of the line with a space symbol
+                has_space = line[next_break - 1] == ' '
+                if has_space and (change_offset == 0 or (change_offset == 1 and starts_run)):
+                    # The space is at the end of the run before this one. When the run only starts
+                    # with the space, wrap_lines takes a character off the end of the run before too.
+                    # FIXME: that's surely not intended, but we match wrap_lines until it's fixed there
+                    self.trim_last_run()
+                text_end = change_offset - 1 if has_space and change_offset > 0 else change_offset
+                if text_end > cursor:
+                    self.pending.append([item[cursor:text_end], run])
+                if has_space:
+                    self.pending.append([SPACE_SYMBOL_MARKUP, None])
+                self.pending.append([LINE_SEPARATOR, None])
+                self.pending.append([LINE_CONTINUATION_MARKUP, None])
+                run.has_breaks = True
+                cursor = change_offset
+                next_break = next(breaks, None)
+            self.pending.append([item[cursor:], run])
+        self.line_items = []
+        self.line_text = []
+
+    def trim_last_run(self):
+        """Takes the last character off the run of text in the pending output, and if that
+        leaves nothing of it, off the run before it as well, like wrap_lines does.
+        """
+        for entry in reversed(self.pending):
+            text, run = entry
+            if run is None:
+                continue
+            entry[0] = text[:-1]
+            if run.length > 1 or run.has_breaks:
+                return
+
+    def get_flush_point(self) -> int:
+        """Returns how many pending entries can no longer be trimmed.
+        """
+        for idx in range(len(self.pending) - 1, -1, -1):
+            run = self.pending[idx][1]
+            if run is not None and (run.length > 1 or run.has_breaks):
+                return idx
+        return 0
+
+    def flush(self, count: int) -> str:
+        flushed = ''.join(html_escape(text) if run is not None else text for text, run in self.pending[:count])
+        del self.pending[:count]
+        return flushed
+
+
+def iter_code_block_markup(pre_contents: str, options: Options) -> Iterator[str]:
+    """Highlights, numbers and wraps the code block pre_contents a line at a time, and yields the
+    markup of it inside <pre><code> as it goes. Only the line being wrapped is held, along with
+    the token being highlighted.
+    """
+    wrapper = LineWrapper()
+    yield '<pre><code>'
+    for line in number_lines(iter_highlighted_lines(pre_contents, options), options):
+        yield wrapper.feed(line)
+    yield wrapper.close()
+    yield '</code></pre>'
+
+
+def format_code_block_lines(pre_contents: str, options: Options) -> bs4.BeautifulSoup:
+    """Returns the code block pre_contents inside <pre><code>, the same as highlight_code,
+    add_linenos and wrap_lines would make it, from the markup of iter_code_block_markup. The
+    tree is the only thing as big as the block, and it replaces the block in the article anyway.
+    """
+    markup = io.StringIO()
+    for piece in iter_code_block_markup(pre_contents, options):
+        markup.write(piece)
+    return bs4.BeautifulSoup(markup.getvalue(), 'html.parser')
@@ -51,7 +51,10 @@ class IndFormatter(Formatter):
 
             self.styles[token] = (start, end)
 
-    def format_unencoded(self, tokensource, outfile):
+    def iter_markup(self, tokensource):
+        """Yields the markup of the tokens in tokensource as they come. Unstyled text is yielded
+        right away, so only styled runs of the same token type are ever held in one piece.
+        """
         # lastval is a string we use for caching
         # because it's possible that an lexer yields a number
         # of consecutive tokens with the same token type.
@@ -75,16 +78,24 @@ class IndFormatter(Formatter):
             else:
                 # not the same token as last iteration, but we
                 # have some data in the buffer. wrap it with the
-                # defined style and write it to the output file
+                # defined style and write it to the output
                 if lastval:
                     stylebegin, styleend = self.styles[lasttype]
-                    outfile.write(stylebegin + lastval + styleend)
+                    yield stylebegin + lastval + styleend
                 # set lastval/lasttype to current values
                 lastval = value
                 lasttype = ttype
+            # without tags around it, text comes out the same in any number of pieces
+            if self.styles[lasttype] == ('', ''):
+                yield lastval
+                lastval = ''
 
         # if something is left in the buffer, write it to the
-        # output file, then close the opened <pre> tag
+        # output
         if lastval:
             stylebegin, styleend = self.styles[lasttype]
-            outfile.write(stylebegin + lastval + styleend)
+            yield stylebegin + lastval + styleend
+
+    def format_unencoded(self, tokensource, outfile):
+        for markup in self.iter_markup(tokensource):
+            outfile.write(markup)
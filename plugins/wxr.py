@@ -0,0 +1,72 @@
+import mmap
+import re
+from typing import Iterator, Tuple
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element
+from xml.sax.saxutils import escape
+
+ITEM_START = b'<item>'
+ITEM_END = b'</item>'
+CDATA_START = b'<![CDATA['
+CDATA_END = b']]>'
+RSS_START = b'<rss'
+NAMESPACE_REGEX = re.compile(rb'''xmlns:[\w.-]+\s*=\s*(?:"[^"]*"|'[^']*')''')
+
+
+def find_outside_cdata(buf, needle: bytes, pos: int) -> int:
+    """Like buf.find(needle, pos), but skips over anything inside CDATA sections, where
+    article content could contain markup of its own.
+    """
+    while True:
+        found = buf.find(needle, pos)
+        if found == -1:
+            return -1
+        cdata_start = buf.find(CDATA_START, pos, found)
+        if cdata_start == -1:
+            return found
+        cdata_end = buf.find(CDATA_END, cdata_start + len(CDATA_START))
+        if cdata_end == -1:
+            return -1
+        pos = cdata_end + len(CDATA_END)
+
+
+def iter_item_spans(buf) -> Iterator[Tuple[int, int]]:
+    """Yields the (start, end) byte offsets of every <item> element in buf.
+    """
+    pos = 0
+    while True:
+        start = find_outside_cdata(buf, ITEM_START, pos)
+        if start == -1:
+            return
+        end = find_outside_cdata(buf, ITEM_END, start + len(ITEM_START))
+        if end == -1:
+            return
+        pos = end + len(ITEM_END)
+        yield start, pos
+
+
+def get_namespace_declarations(buf) -> bytes:
+    """Returns the xmlns attributes on the <rss> tag, which items need to be parsed on their own.
+    """
+    rss_start = buf.find(RSS_START)
+    if rss_start == -1:
+        return b''
+    rss_end = buf.find(b'>', rss_start)
+    return b' '.join(NAMESPACE_REGEX.findall(buf[rss_start:rss_end]))
+
+
+def read_tagged_items(path: str, tag: str) -> Iterator[Element]:
+    """Memory-maps the WordPress dump at path and yields the <item> elements that might be tagged with tag.
+
+    Items are found by scanning bytes, and only those that contain tag somewhere are parsed,
+    so the rest of the dump never turns into Python objects. Callers still have to check the
+    categories of each item.
+    """
+    tag_bytes = {tag.encode('utf-8'), escape(tag).encode('utf-8')}
+    with open(path, 'rb') as dump_file, mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        item_wrapper_start = b'<rss ' + get_namespace_declarations(buf) + b'>'
+        for start, end in iter_item_spans(buf):
+            if all(buf.find(tag_candidate, start, end) == -1 for tag_candidate in tag_bytes):
+                continue
+            wrapped = ElementTree.fromstring(item_wrapper_start + buf[start:end] + b'</rss>')
+            yield wrapped[0]
@@ -3,25 +3,36 @@ import os
 import os.path
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, SubElement
-from typing import Dict, List, Callable
+from typing import Dict, List, Callable, Iterable, Iterator, Optional, Set, Tuple, Type, Union
 import re
 import urllib.request
 import urllib.parse
-import urllib.error
 import html
+from html.parser import HTMLParser
 import shutil
 import hashlib
+import functools
 import subprocess
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import bs4
 from bs4 import BeautifulSoup, Tag
-import pylatex
 from PIL import Image
 
-from util import LINE_SEPARATOR, VERBATIM_TAGS, keep_verbatim, html_escape
-from plugins.preformatted import highlight_code, add_linenos, wrap_lines
+from util import LINE_SEPARATOR, VERBATIM_TAGS, keep_verbatim, html_escape, memoized_transform, get_transform_cache_stats
+from plugins import events
+from plugins.events import JsonLinesWriter, ProgressSummary, emit, open_event_file
+from plugins.assets import LinkedAsset, get_download_service, get_links, restore_missing_links, shutdown_download_service, take_links
+from plugins.highlight_cache import get_cache as get_highlight_cache, get_cache_key as get_highlight_cache_key
+from plugins.imgur import IMGUR_IMAGE_URL_TEMPL, VOID_ELEMENTS, EmbedKey, get_embed_key, resolve_embeds
+from plugins.inline import INLINE_PRECEDENCE, InlineToken, InlineTokenType, InlineTokenizer
+from plugins.latex import get_service as get_latex_service, shutdown_service as shutdown_latex_service
+from plugins.preformatted import STREAMING_PRE_LENGTH, highlight_code, add_linenos, wrap_lines, format_code_block_lines
 from plugins.smart_quotes import get_quote_direction, get_double_quote, get_single_quote
 from plugins.syntax_highlighting import SyntaxHighlightType, get_syntax_highlight_tag_name
+from plugins.wxr import read_tagged_items
 
 #The directory to store generated assets. Can be changed by command line argument.
 ASSET_DIR = 'assets'
@@ -32,6 +43,8 @@ CURRENT_DIR: str
 #273 pt, at 300 DPI
 DPI = 300
 IMAGE_WIDTH_DEFAULT = 1138
+# Number of articles written out at once in sharded mode
+SHARD_WORKERS = 4
 USER_AGENT = "curl/7.61" # 'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:81.0) Gecko/20100101 Firefox/81.0'
 
 # Name of category for approved articles
@@ -41,19 +54,47 @@ XML_NS = {
     'content': 'http://purl.org/rss/1.0/modules/content/',
     'wp': 'http://wordpress.org/export/1.2/'
 }
+# Fully qualified names of the namespaced tags we read out of each <item>
+CONTENT_TAG = f"{{{XML_NS['content']}}}encoded"
+POST_META_TAG = f"{{{XML_NS['wp']}}}postmeta"
+META_KEY_TAG = f"{{{XML_NS['wp']}}}meta_key"
+META_VALUE_TAG = f"{{{XML_NS['wp']}}}meta_value"
 
 #this is illegal or whatever, but I am the law.
 urllib.request.URLopener.version = USER_AGENT
 
 class Article:
+    # Articles are kept around for the whole export, so keep them small
+    __slots__ = ('author', 'title', 'subtitle', 'raw_content', 'raw_postscript', 'content', 'index')
 
     def __init__(self):
         self.author = ''
         self.title = ''
         self.subtitle = ''
-        # content and postscript is stored as a beautiful soup tree
+        # content and postscript are kept as raw HTML until the article is processed
+        self.raw_content = ''
+        self.raw_postscript: Optional[str] = None
+        # content is stored as a beautiful soup tree, only while the article is being processed
         self.content: BeautifulSoup = None
-        self.postscript: BeautifulSoup = None
+        # what index_article found in the content, before any pass touched it
+        self.index: ArticleIndex = None
+
+    def parse(self) -> 'Article':
+        """Parses the raw content and postscript into the content tree.
+        """
+        self.content = BeautifulSoup(self.raw_content, 'html.parser')
+        # TODO: instead of appending to content, process postscript separately
+        if self.raw_postscript is not None:
+            postscript_wrap = self.content.new_tag('footer')
+            postscript_wrap.append(BeautifulSoup(self.raw_postscript, 'html.parser'))
+            self.content.append('\n')
+            self.content.append(postscript_wrap)
+        return self
+
+    def release(self):
+        """Drops the content tree once we're done with it. The raw content is kept.
+        """
+        self.content = None
 
     def get_image_location(self, file: str) -> str:
         #generate a slug by trimming the title, replacing non-ascii chars, and replacing spaces
@@ -93,16 +134,73 @@ class Article:
 
         return article_tag
 
-def is_for_issue(article_tag: Element, issue_num: str) -> bool:
-    """Returns True if the article given by the <item> tag article_tag
+class ArticleIndex:
+    """The footnote markers, LaTeX and images of an article, in document order, collected in one
+    scan of the raw content before the article is parsed. Footnotes are numbered and assets are
+    given their files up front, so later passes only have to look them up, and markup the article
+    doesn't have isn't searched for.
+    """
+    __slots__ = ('markup', 'footnote_markers', 'footnote_numbers', 'formulas', 'images', 'embeds')
+
+    def __init__(self):
+        # every type of inline markup in the article
+        self.markup: Set[InlineTokenType] = set()
+        # the digits inside each [] footnote marker, and the number each one gets
+        self.footnote_markers: List[str] = []
+        self.footnote_numbers: List[int] = []
+        # LaTeX source including delimiters -> PDF location (without .pdf)
+        self.formulas: Dict[str, str] = dict()
+        # image URL -> local path
+        self.images: Dict[str, str] = dict()
+        # Imgur galleries without an extension -> image URL, or the error scraping it. None until
+        # resolve_index_embeds has scraped every gallery in the issue
+        self.embeds: Dict[EmbedKey, Optional[Union[str, Exception]]] = dict()
+
+class ItemFields:
+    """The parts of an <item> tag we care about, collected in one pass over its children.
+    """
+    __slots__ = ('title', 'categories', 'post_meta', 'content')
+
+    def __init__(self):
+        self.title = ''
+        # (domain, name) pairs
+        self.categories: List[Tuple[str, str]] = []
+        # (meta_key, meta_value) pairs
+        self.post_meta: List[Tuple[str, str]] = []
+        self.content = ''
+
+def scan_item(article_tag: Element) -> ItemFields:
+    """Walks the children of the <item> tag article_tag once and collects its fields.
+    """
+    item = ItemFields()
+    for child in article_tag:
+        tag = child.tag
+        if tag == 'category':
+            item.categories.append((child.get('domain'), child.text))
+        elif tag == POST_META_TAG:
+            meta_key = meta_value = None
+            for meta_child in child:
+                if meta_child.tag == META_KEY_TAG:
+                    meta_key = meta_child.text
+                elif meta_child.tag == META_VALUE_TAG:
+                    meta_value = meta_child.text
+            item.post_meta.append((meta_key, meta_value))
+        elif tag == 'title':
+            item.title = child.text
+        elif tag == CONTENT_TAG:
+            item.content = child.text
+    return item
+
+def is_for_issue(item: ItemFields, issue_num: str) -> bool:
+    """Returns True if the article given by the scanned <item> tag item
     belongs to the issue given by issue_num, and it is editor okayed
     """
     has_correct_tag = False
     has_approval = False
-    for category in article_tag.findall('category'):
-        if category.get('domain') == 'post_tag' and category.text == issue_num:
+    for domain, name in item.categories:
+        if domain == 'post_tag' and name == issue_num:
             has_correct_tag = True
-        elif category.get('domain') == 'category' and category.text == APPROVED_CATEGORY:
+        elif domain == 'category' and name == APPROVED_CATEGORY:
             has_approval = True
     return has_correct_tag and has_approval
 
@@ -110,108 +208,330 @@ def filter_articles(tree: ElementTree, issue_num: str) -> List[Article]:
     """Given an ElementTree parsed from an XML dump, returns a list
     of Article instances containing all the articles tagged with issue_num.
     """
-    root = tree.getroot()
+    return filter_items(tree.getroot().iter('item'), issue_num)
+
+def filter_items(article_tags: Iterable[Element], issue_num: str) -> List[Article]:
+    """Given <item> tags from an XML dump, returns a list
+    of Article instances containing all the articles tagged with issue_num.
+    """
     articles: List[Article] = []
-    article_tags = root.findall('.//item')
     for article_tag in article_tags:
-        if not is_for_issue(article_tag, issue_num):
+        item = scan_item(article_tag)
+        if not is_for_issue(item, issue_num):
             continue
         article = Article()
-        #possible optimization, instead of calling find several times,
-        #loop through tag children once and parse out data as we run into it
-        article.title = article_tag.find('title').text
+        article.title = item.title
         # go through post meta tags
-        post_meta_tags = article_tag.findall('wp:postmeta', XML_NS)
-        for post_meta_tag in post_meta_tags:
-            meta_key = post_meta_tag.find('wp:meta_key', XML_NS).text
-            meta_value = post_meta_tag.find('wp:meta_value', XML_NS).text
-
+        for meta_key, meta_value in item.post_meta:
             if meta_key == 'mn_subtitle':
                 article.subtitle = meta_value
             elif meta_key == 'mn_author':
                 article.author = meta_value
             elif meta_key == 'mn_postscript':
-                article.postscript = BeautifulSoup(meta_value, 'html.parser')
-        #we will post process this later
-        article_text_content = article_tag.find('content:encoded', XML_NS).text
-        article.content = BeautifulSoup(article_text_content, 'html.parser')
-        # TODO: instead of appending to content, process postscript separately
-        if article.postscript is not None:
-            postscript_wrap = article.content.new_tag('footer')
-            postscript_wrap.append(article.postscript)
-            article.content.append('\n')
-            article.content.append(postscript_wrap)
+                article.raw_postscript = meta_value
+        #we will parse and post process this later
+        article.raw_content = item.content
         articles.append(article)
     return articles
 
-def replace_text_with_tag(sub_text: str,
-                          repl_tag: Tag,
-                          text_tag: bs4.NavigableString,
-                          article: Article) -> bs4.NavigableString:
-    #if we can't find the parent, assume it's just the document
-    parent: Tag
-    if text_tag.parent == None or text_tag.parent.name == '[document]':
-        parent = article.content
-    else:
-        parent = text_tag.parent
-    tag_idx = parent.contents.index(text_tag)
-    #replace the matched text with a tag
-    begin, _, end = text_tag.partition(sub_text)
-    #convert these strings to tags
-    begin = bs4.NavigableString(begin)
-    end = bs4.NavigableString(end)
-    text_tag.replace_with(begin)
-    parent.insert(tag_idx + 1, repl_tag)
-    parent.insert(tag_idx + 2, end)
-    return end
+class InlineHandler:
+    """Turns inline markup tokens of one type into nodes.
 
-def convert_imgur_embeds(article: Article) -> Article:
+    prepare is given every token of the type in the article before any are rendered, so slow work
+    can be started for all of them at once. render is then called on each token in document order,
+    and returns the node to replace it with, or None to leave its text alone.
+    """
+
+    def __init__(self, article: Article):
+        self.article = article
+
+    def prepare(self, tokens: List[InlineToken]):
+        pass
+
+    def render(self, token: InlineToken) -> Optional[bs4.PageElement]:
+        raise NotImplementedError
+
+class ImgurEmbedHandler(InlineHandler):
     """Converts Imgur embeds of the form `[embed]https://imgur.com/...[/embed]` into image tags.
     It does so by scraping the Imgur embed page and retrieving the image URL of the first image it sees.
     As a result, we don't (yet) support multiple images.
     """
-    imgur_url_regex = re.compile(r'''
-    (?:https?:)?//
-    (?:i\.)?                  # Don't care if the URL uses the i.imgur.com subdomain
-    imgur.com/
-    (?P<scheme>a/|gallery/)?  # Don't care about URL scheme
-    (?P<hash>\w{5}(?:\w\w)*)  # Match the gallery hash, which will be an odd number of characters
-    .?                        # Don't care about any extraneous characters
-    (?P<ext>\.\w+)?           # Match any potential file extensions
-    ''', re.VERBOSE | re.ASCII)
-    imgur_regex = re.compile(rf'''\[embed\]{imgur_url_regex.pattern}\[/embed\]''', re.VERBOSE | re.ASCII)
-    imgur_url_templ = 'https://i.imgur.com/{hash}{ext}'
 
-    for text_tag in article.content.find_all(text=True):
+    def prepare(self, tokens: List[InlineToken]):
+        # Galleries without an extension were scraped for the whole issue by resolve_index_embeds,
+        # anything it didn't see is scraped now, all at once
+        index = self.article.index
+        self.resolved_embeds = dict(index.embeds) if index is not None else dict()
+        keys = (get_embed_key(token.match) for token in tokens if token.match['ext'] is None)
+        self.resolved_embeds.update(resolve_embeds(key for key in keys if self.resolved_embeds.get(key) is None))
+
+    def render(self, token: InlineToken) -> Optional[bs4.PageElement]:
+        match = token.match
+        img_url = IMGUR_IMAGE_URL_TEMPL.format(**match.groupdict())
+        if match['ext'] is None:
+            # No file extension, use the scraped image URL
+            img_url = self.resolved_embeds[get_embed_key(match)]
+            if isinstance(img_url, Exception):
+                print(f'Error downloading Imgur gallery {match[0]}. Reason: {img_url}')
+                input('[Enter] to continue...')
+                return None
+        # Replace embed code with an actual img tag
+        return self.article.content.new_tag('img', src=img_url)
+
+def get_formula_location(article: Article, latex: str) -> str:
+    """Returns where the PDF for latex (including its delimiters) goes, without the .pdf extension.
+    """
+    if article.index is not None and latex in article.index.formulas:
+        return article.index.formulas[latex]
+    # just use the hash of the latex for a unique filename, this should probably never collide
+    # NOTE: sha1 is used for speed; we do not use the built-in `hash` function as it is non-deterministic across runs.
+    #       We do NOT need to care about security risks, since we are solely concerned with uniqueness.
+    return article.get_pdf_location(hashlib.sha1(latex.encode('utf-8')).hexdigest())
+
+def get_image_path(article: Article, url: str) -> str:
+    if article.index is not None and url in article.index.images:
+        return article.index.images[url]
+    filename = os.path.basename(urllib.parse.urlparse(url).path)
+    return article.get_image_location(filename)
+
+class LatexHandler(InlineHandler):
+    """Compiles embedded LaTeX into PDFs, and adds the proper tags so they show up on import.
+    Links go in right away, the PDFs are checked for once the issue is done.
+    """
+
+    def prepare(self, tokens: List[InlineToken]):
+        # Formulas were queued up by index_article, this only finds their futures
+        latex_service = get_latex_service()
+        self.compiled: Dict[str, Tuple[str, Future]] = dict()
+        for token in tokens:
+            match = token.match
+            if match[0] in self.compiled: continue
+            filename = get_formula_location(self.article, match[0])
+            self.compiled[match[0]] = filename, latex_service.submit(match[1], filename, display=(match[0][1] == '['))
+
+    def render(self, token: InlineToken) -> Optional[bs4.PageElement]:
+        filename, future = self.compiled[token.match[0]]
+        # if the formula doesn't compile, its source goes back in, as if it was never converted
+        href = get_links().add(filename + '.pdf', future, token.match[1], bs4.NavigableString(token.text).output_ready())
+        return Tag(name='link', attrs={'href': href})
+
+class InlineCodeHandler(InlineHandler):
+    """Replaces Markdown-style inline code with actual code tags
+    """
+
+    def render(self, token: InlineToken) -> Optional[bs4.PageElement]:
+        code_tag = Tag(name='code')
+        code_tag.string = token.match[1]
+        return code_tag
+
+def number_footnotes(markers: List[str]) -> List[int]:
+    """Given the digits inside each footnote marker in order, returns the number of each footnote.
+    """
+    numbers = []
+    footnote_counter = 1  # is the expected number of the next footnote
+    for marker in markers:
+        # Check match for provided numbering -- if it exists, then use it
+        footnote_num = footnote_counter
+        if len(marker):
+            footnote_num = int(marker)
+        numbers.append(footnote_num)
+        # Only auto-increment if blank or explicitly incremented
+        if len(marker) == 0 or footnote_num == footnote_counter:
+            footnote_counter += 1
+    return numbers
+
+class FootnoteHandler(InlineHandler):
+    """Replaces footnotes in [\d] format with <sup></sup> tags"""
+
+    def prepare(self, tokens: List[InlineToken]):
+        markers = [token.match[1] for token in tokens]
+        index = self.article.index
+        # LaTeX or embeds that failed to convert can expose markers the index didn't count on
+        if index is not None and index.footnote_markers == markers:
+            numbers = index.footnote_numbers
+        else:
+            numbers = number_footnotes(markers)
+        self.footnote_numbers = {id(token): number for token, number in zip(tokens, numbers)}
+
+    def render(self, token: InlineToken) -> Optional[bs4.PageElement]:
+        sup_tag = Tag(name='sup')
+        sup_tag.string = str(self.footnote_numbers[id(token)])
+        return sup_tag
+
+INLINE_HANDLERS: Dict[InlineTokenType, Type[InlineHandler]] = {
+    InlineTokenType.Embed: ImgurEmbedHandler,
+    InlineTokenType.Math: LatexHandler,
+    InlineTokenType.Code: InlineCodeHandler,
+    InlineTokenType.Footnote: FootnoteHandler,
+}
+
+def convert_inline_markup(article: Article, token_types: Iterable[InlineTokenType] = (
+        InlineTokenType.Embed, InlineTokenType.Math, InlineTokenType.Code)) -> Article:
+    """Converts inline markup in the article content into tags.
+
+    Text nodes are split up in memory, one type of markup at a time in order of precedence, so
+    markup that can't be converted is left as text that later types can still match across.
+    Each text node is spliced into the tree once at the end.
+    """
+    index = article.index
+    # Types the index didn't find anywhere in the article aren't searched for. Unless there are
+    # embeds, which can go back in as text that other markup matches across if they don't convert
+    if index is not None and InlineTokenType.Embed not in index.markup:
+        token_types = [token_type for token_type in token_types if token_type in index.markup]
+        if not token_types:
+            return article
+    tokenizer = InlineTokenizer(token_types)
+    text_tag: bs4.NavigableString
+    tokenized_tags = []
+    for text_tag in article.content.find_all(string=True):
         if keep_verbatim(text_tag): continue
 
-        for match in imgur_regex.finditer(text_tag):
-            img_url = imgur_url_templ.format(**match.groupdict())
-            if match['ext'] is None:
-                # No file extension, have to scrape
-                try:
-                    with urllib.request.urlopen('https://imgur.com/{scheme}{hash}/embed?pub=true'.format(**match.groupdict(default=''))) as resp:
-                        if resp.getcode() != 200:
-                            raise ValueError('Gallery does not exist')
-                        html_text = resp.read()
-                        imgur_soup = BeautifulSoup(html_text, 'html.parser')
-                    img_el = imgur_soup.find(id='image')
-                    if img_el is None:
-                        raise ValueError('Could not find image source in returned webpage')
-                except (urllib.error.HTTPError, ValueError) as e:
-                    print(f'Error downloading Imgur gallery {match[0]}. Reason: {e}')
-                    input('[Enter] to continue...')
-                    continue
-                # Filter url given in content
-                img_el = img_el.find('img', class_='post')
-                img_hash = imgur_url_regex.match(img_el['src'])
-                img_url = imgur_url_templ.format(**img_hash.groupdict())
-            # Replace embed code with an actual img tag
-            img_tag = article.content.new_tag('img', src=img_url)
-            text_tag = replace_text_with_tag(match[0], img_tag, text_tag, article)
+        if tokenizer.has_markup(text_tag):
+            tokenized_tags.append((text_tag, [str(text_tag)]))
+
+    for token_type in tokenizer.token_types:
+        handler = INLINE_HANDLERS[token_type](article)
+        for idx, (text_tag, pieces) in enumerate(tokenized_tags):
+            tokenized_tags[idx] = text_tag, tokenizer.split(pieces, token_type)
+        handler.prepare([piece for _, pieces in tokenized_tags for piece in pieces if isinstance(piece, InlineToken)])
+
+        for idx, (text_tag, pieces) in enumerate(tokenized_tags):
+            rendered = []
+            for piece in pieces:
+                if isinstance(piece, InlineToken):
+                    node = handler.render(piece)
+                    piece = piece.text if node is None else node
+                # fold text back together around markup we couldn't convert
+                if isinstance(piece, str) and rendered and isinstance(rendered[-1], str):
+                    rendered[-1] += piece
+                else:
+                    rendered.append(piece)
+            tokenized_tags[idx] = text_tag, rendered
+
+    for text_tag, pieces in tokenized_tags:
+        if len(pieces) > 1:
+            text_tag.replace_with(*(bs4.NavigableString(piece) if isinstance(piece, str) else piece for piece in pieces))
+    return article
+
+class IndexParser(HTMLParser):
+    """Collects the text outside of verbatim tags and the image sources in raw HTML, without
+    building a tree. Tags are closed the way BeautifulSoup's html.parser builder closes them, so
+    text comes out in the same pieces as the strings of the parsed content.
+    """
 
+    def __init__(self):
+        self.texts: List[str] = []
+        self.image_urls: List[str] = []
+        HTMLParser.__init__(self)
+
+    def reset(self):
+        HTMLParser.reset(self)
+        self.open_tags: List[str] = []
+        # number of open verbatim tags we're inside of
+        self.verbatim_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'img':
+            url = dict(attrs).get('src')
+            if url is not None:
+                self.image_urls.append(url)
+        if tag in VOID_ELEMENTS:
+            return
+        self.open_tags.append(tag)
+        if tag in VERBATIM_TAGS:
+            self.verbatim_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # a closing tag closes everything opened since its opening tag, stray ones are ignored
+        if tag not in self.open_tags:
+            return
+        while True:
+            open_tag = self.open_tags.pop()
+            if open_tag in VERBATIM_TAGS:
+                self.verbatim_depth -= 1
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.verbatim_depth:
+            self.texts.append(data)
+
+    # comments and CDATA sections are strings in the parsed content too
+    handle_comment = handle_data
+
+    def unknown_decl(self, data):
+        if data.startswith('CDATA['):
+            self.handle_data(data[len('CDATA['):])
+
+def index_article(article: Article) -> Article:
+    """Scans the raw article content once, before any pass runs, for footnote markers, LaTeX,
+    embeds and images. Footnotes are numbered and every asset gets its file ahead of time, and
+    the LaTeX and images start compiling and downloading in the background right away.
+    """
+    parser = IndexParser()
+    # the postscript is parsed on its own, like in Article.parse
+    for source in (article.raw_content, article.raw_postscript):
+        if source is None: continue
+        parser.feed(source)
+        parser.close()
+        parser.reset()
+
+    index = ArticleIndex()
+    tokenizer = InlineTokenizer(INLINE_PRECEDENCE)
+    latex_service = get_latex_service()
+    download_service = get_download_service()
+    for text in parser.texts:
+        # normalize_newlines hasn't run yet, and the LaTeX source is hashed for its filename
+        for piece in tokenizer.tokenize(text.replace('\r\n', '\n')):
+            if not isinstance(piece, InlineToken): continue
+
+            match = piece.match
+            index.markup.add(piece.type)
+            if piece.type == InlineTokenType.Footnote:
+                index.footnote_markers.append(match[1])
+            elif piece.type == InlineTokenType.Math and match[0] not in index.formulas:
+                filename = get_formula_location(article, match[0])
+                index.formulas[match[0]] = filename
+                latex_service.submit(match[1], filename, display=(match[0][1] == '['))
+            elif piece.type == InlineTokenType.Embed and match['ext'] is not None:
+                url = IMGUR_IMAGE_URL_TEMPL.format(**match.groupdict())
+                index.images[url] = get_image_path(article, url)
+            elif piece.type == InlineTokenType.Embed:
+                index.embeds.setdefault(get_embed_key(match), None)
+    index.footnote_numbers = number_footnotes(index.footnote_markers)
+
+    for url in parser.image_urls:
+        index.images[url] = get_image_path(article, url)
+
+    for url, local_path in index.images.items():
+        download_service.submit(local_path, download_image, url, local_path)
+
+    article.index = index
     return article
 
+def resolve_index_embeds(articles: List[Article]):
+    """Scrapes every Imgur gallery without an extension in the indexed articles at once, and keeps
+    the image URLs in their indexes. The images start downloading in the background right away.
+    """
+    resolved = resolve_embeds(key for article in articles for key in article.index.embeds)
+    download_service = get_download_service()
+    for article in articles:
+        index = article.index
+        for key in index.embeds:
+            img_url = index.embeds[key] = resolved[key]
+            if isinstance(img_url, Exception) or img_url in index.images: continue
+
+            local_path = index.images[img_url] = get_image_path(article, img_url)
+            download_service.submit(local_path, download_image, img_url, local_path)
+
+def convert_imgur_embeds(article: Article) -> Article:
+    return convert_inline_markup(article, [InlineTokenType.Embed])
+
 def resize_image(image_path: str):
     """Resizes the image at image_path to a standard size so they don't import
     into InDesign at giant size.
@@ -222,11 +542,22 @@ def resize_image(image_path: str):
     scale_factor = IMAGE_WIDTH_DEFAULT / w
     image.resize((int(w * scale_factor), int(h * scale_factor))).save(image_path, dpi=(DPI, DPI))
 
+def download_image(url: str, local_path: str):
+    """Downloads the image at url to local_path and resizes it. Runs on a download worker.
+    """
+    print(f"Downloading {local_path}\t{url}", flush=True)
+    start = time.perf_counter()
+    urllib.request.urlretrieve(url, local_path)
+    emit('download', url=url, path=local_path, bytes=os.path.getsize(local_path), seconds=time.perf_counter() - start)
+    #resize the image to a reasonable size
+    resize_image(local_path)
+
 def download_images(article: Article) -> Article:
-    """Looks through the article content for image tags and downloads them locally and saves
-    them as an asset. Then, it changes the link text to point to the local copy instead of
-    the web copy.
+    """Looks through the article content for image tags, and changes the link text to point to
+    a local copy instead of the web copy. The local copy is downloaded in the background, most
+    of them were already started by index_article.
     """
+    download_service = get_download_service()
     img_tag: Tag
     for img_tag in article.content.find_all('img'):
         # try block because sometimes images without sources get added (don't ask me why)
@@ -234,99 +565,19 @@ def download_images(article: Article) -> Article:
             url = img_tag.attrs['src']
         except KeyError:
             continue
-        filename = os.path.basename(urllib.parse.urlparse(url).path)
-        local_path = article.get_image_location(filename)
-        print(f"Downloading {local_path}\t{url}", flush=True)
-        try:
-            urllib.request.urlretrieve(url, local_path)
-            #resize the image to a reasonable size
-            resize_image(local_path)
-            #InDesign recognizes <link href=""> tags for images
-            img_tag.name = 'link'
-            img_tag.attrs['href'] = 'file://' + local_path
-        except urllib.error.HTTPError as e:
-            print(f'Error downloading image {url}. Reason: {e}')
-            input("[Enter] to continue...")
-        except FileNotFoundError as e:
-            print(f'Error downloading image {url}. Reason: {e}')
-            input("[Enter] to continue...")
+        local_path = get_image_path(article, url)
+        future = download_service.submit(local_path, download_image, url, local_path)
+        href = get_links().add(local_path, future, url, str(img_tag))
+        #InDesign recognizes <link href=""> tags for images
+        img_tag.name = 'link'
+        img_tag.attrs['href'] = href
     return article
 
-class Preview(pylatex.base_classes.Environment):
-    packages = [pylatex.Package('preview', ['active', 'tightpage', 'pdftex'])]
-    escape = False
-    content_separator = "\n"
-
-def compile_latex_str(latex: str, filename: str, display: bool = False):
-    """Compiles the string latex into a PDF, and saves it to filename.
-    """
-    document = pylatex.Document()
-    document.packages.append(pylatex.Package('amsmath'))
-    document.packages.append(pylatex.Package('amssymb'))
-    document.packages.append(pylatex.Package('amsfonts'))
-    document.preamble.append(pylatex.Command('thispagestyle', 'empty'))
-    # People seem to think \Z, \R and \Q exist, even though they don't. Just add them in to avoid problems.
-    document.preamble.append(pylatex.NoEscape(r'\newcommand{\Z}{\mathbb{Z}}'))
-    document.preamble.append(pylatex.NoEscape(r'\newcommand{\R}{\mathbb{R}}'))
-    document.preamble.append(pylatex.NoEscape(r'\newcommand{\Q}{\mathbb{Q}}'))
-    with document.create(Preview()):
-        document.append(pylatex.NoEscape((r'\[' if display else r'\(') + latex + (r'\]' if display else r'\)')))
-    document.generate_pdf(filename, compiler='pdflatex')
-    print(f"{filename}\t{latex}", flush=True)
-
 def compile_latex(article: Article) -> Article:
-    """Looks through the article content for embedded LaTeX and compiles it into
-    PDFs, and adds the proper tags so they show up on import.
-    """
-    text_tag: bs4.NavigableString
-    #matches LaTeX inside one or two dollar signs
-    inline_regex = r'\\[([]([\s\S]+?)\\[)\]]'
-    # Compiled regex
-    p = re.compile(inline_regex)
-    # Memo to store validity and compile status of latex
-    latex_valid_memo: Dict[str, bool] = dict()
-    latex_compiled_memo: Dict[str, bool] = dict()
-    for text_tag in article.content.find_all(text=True):
-        if keep_verbatim(text_tag): continue
-
-        for match in p.finditer(text_tag):
-            # if this is invalid latex, skip
-            if latex_valid_memo.get(match[1], True) == False: continue
-
-            latex = match[1]
-            # just use the hash of the latex for a unique filename, this should probably never collide
-            # NOTE: sha1 is used for speed; we do not use the built-in `hash` function as it is non-deterministic across runs.
-            #       We do NOT need to care about security risks, since we are solely concerned with uniqueness.
-            filename = article.get_pdf_location(hashlib.sha1(match[0].encode('utf-8')).hexdigest())
-            if match[0] not in latex_compiled_memo:
-                try:
-                    compile_latex_str(latex, filename, display=(match[0][1] == '['))
-                    latex_valid_memo[latex] = True
-                    latex_compiled_memo[match[0]] = True
-                except subprocess.CalledProcessError:
-                    latex_valid_memo[latex] = False
-                    input("[Enter] to continue...")
-                    continue
-            link_tag = Tag(name='link', attrs={'href': 'file://' + filename + '.pdf'})
-            #set the current tag to the new end tag
-            text_tag = replace_text_with_tag(match[0], link_tag, text_tag, article=article)
-    return article
+    return convert_inline_markup(article, [InlineTokenType.Math])
 
 def replace_inline_code(article: Article) -> Article:
-    """Replaces Markdown-style inline code with actual code tags
-    """
-    text_tag: bs4.NavigableString
-    p = re.compile(r'`([\s\S]+?)`')
-    for text_tag in article.content.find_all(text=True):
-        if keep_verbatim(text_tag): continue
-
-        for match in p.finditer(text_tag):
-            code = match[1]
-            code_tag = Tag(name='code')
-            code_tag.string = code
-            text_tag = replace_text_with_tag(match[0], code_tag, text_tag, article=article)
-
-    return article
+    return convert_inline_markup(article, [InlineTokenType.Code])
 
 def convert_manual_syntax_highlighting(article: Article) -> Article:
     """Manually highlighted code gets custom styling
@@ -350,7 +601,9 @@ def format_code_blocks(article: Article) -> Article:
       - Using Pygments to highlight code
       - Inserting line numbers
       - Wrapping code
+    Blocks formatted by an earlier run are taken from the highlight cache instead.
     """
+    highlight_cache = get_highlight_cache()
     pre_tag: bs4.NavigableString
     options_regex = re.compile(r'''
     :(\S+?):  # Match the option name
@@ -375,15 +628,29 @@ def format_code_blocks(article: Article) -> Article:
             for option_match in options_regex.finditer(options_block[0]):  # match and save options
                 options[option_match[1]] = option_match[2] or True  # if no value given, turn into boolean
 
-        pre_contents = highlight_code(pre_contents, options)
-        pre_contents = add_linenos(pre_contents, options)
-
-        new_tag = wrap_lines(BeautifulSoup(f'<pre><code>{pre_contents}</code></pre>', 'html.parser'))
-
+        cache_key = get_highlight_cache_key(pre_contents, options) if highlight_cache is not None else None
+        cached = highlight_cache.get(cache_key) if highlight_cache is not None else None
+        if cached is not None:
+            new_tag = BeautifulSoup(cached, 'html.parser')
+        elif len(pre_contents) > STREAMING_PRE_LENGTH:
+            # huge tables and ASCII art get the same treatment, just a line at a time
+            new_tag = format_code_block_lines(pre_contents, options)
+        else:
+            pre_contents = highlight_code(pre_contents, options)
+            pre_contents = add_linenos(pre_contents, options)
+
+            new_tag = wrap_lines(BeautifulSoup(f'<pre><code>{pre_contents}</code></pre>', 'html.parser'))
+
+        if highlight_cache is not None and cached is None:
+            highlight_cache.put(cache_key, str(new_tag))
         pre_tag.replace_with(new_tag)
 
     return article
 
+@memoized_transform
+def ellipsize(text: str) -> str:
+    return text.replace('...', '…')
+
 def replace_ellipses(article: Article) -> Article:
     """Replaces "..." with one single ellipse character
     """
@@ -391,10 +658,43 @@ def replace_ellipses(article: Article) -> Article:
     for text_tag in article.content.find_all(text=True):
         if keep_verbatim(text_tag): continue
 
-        new_tag = text_tag.replace('...', '…')
-        text_tag.replace_with(new_tag)
+        text_tag.replace_with(ellipsize(str(text_tag)))
     return article
 
+# Runs of spaces, hyphens and em dashes with at least one dash in them. None of the dash rules
+# look past the ends of a run, so each run can be rewritten on its own.
+DASH_RUN_REGEX = re.compile(r' *[\-—][ \-—]*')
+# Hyphens between two numbers make a numeric range
+NUMERIC_RANGE_REGEX = re.compile(r' ?--? ?')
+DIGIT_REGEX = re.compile(r'\d')
+
+@functools.lru_cache(maxsize=256)
+def normalize_dash_run(run: str, between_digits: bool) -> str:
+    if between_digits and NUMERIC_RANGE_REGEX.fullmatch(run):
+        return '–'
+    return run \
+        .replace(' - ', '—') \
+        .replace(' --- ', '—') \
+        .replace('---', '—') \
+        .replace(' -- ', '—') \
+        .replace('--', '—') \
+        .replace(' — ', '—') \
+        .replace('—', ' — ')
+
+def replace_dash_run(match: re.Match) -> str:
+    text = match.string
+    start, end = match.span()
+    between_digits = start > 0 and DIGIT_REGEX.match(text, start - 1) is not None \
+        and DIGIT_REGEX.match(text, end) is not None
+    return normalize_dash_run(match[0], between_digits)
+
+@memoized_transform
+def dashify(text: str) -> str:
+    # Most text has no dashes at all, and checking for them is much cheaper than a regex scan
+    if '-' not in text and '—' not in text:
+        return text
+    return DASH_RUN_REGEX.sub(replace_dash_run, text)
+
 def replace_dashes(article: Article) -> Article:
     """Replaces hyphens used as spacing, that is, when they are surrounded with spaces,
     with em dashes.
@@ -404,15 +704,7 @@ def replace_dashes(article: Article) -> Article:
     for text_tag in article.content.find_all(text=True):
         if keep_verbatim(text_tag): continue
 
-        new_tag = re.sub(r'(?<=\d) ?--? ?(?=\d)', '–', text_tag) \
-            .replace(' - ', '—') \
-            .replace(' --- ', '—') \
-            .replace('---', '—') \
-            .replace(' -- ', '—') \
-            .replace('--', '—') \
-            .replace(' — ', '—') \
-            .replace('—', ' — ')
-        text_tag.replace_with(new_tag)
+        text_tag.replace_with(dashify(str(text_tag)))
     return article
 
 def replace_smart_quotes(s: str):
@@ -464,6 +756,10 @@ def add_smart_quotes(article: Article) -> Article:
 
     return article
 
+@memoized_transform
+def collapse_spaces(text: str) -> str:
+    return re.sub(r'(?<=[.,;?!‽]) +', ' ', text)
+
 def remove_extraneous_spaces(article: Article) -> Article:
     """Removes extraneous spaces after punctuation.
     """
@@ -471,8 +767,7 @@ def remove_extraneous_spaces(article: Article) -> Article:
     for text_tag in article.content.find_all(text=True):
         if keep_verbatim(text_tag): continue
 
-        new_tag = re.sub(r'(?<=[.,;?!‽]) +', ' ', text_tag)
-        text_tag.replace_with(new_tag)
+        text_tag.replace_with(collapse_spaces(str(text_tag)))
     return article
 
 def normalize_newlines(article: Article) -> Article:
@@ -484,56 +779,67 @@ def normalize_newlines(article: Article) -> Article:
         text_tag.replace_with(new_tag)
     return article
 
+@memoized_transform
+def separate_lines(text: str, has_prev_sibling: bool, has_next_sibling: bool) -> str:
+    # Split along single line breaks
+    new_tag_builder = re.split('(?<!\n)\n(?!\n)', text)
+    # Keep single line breaks that appear next to another tag, by throwing them out and
+    # manually placing a newline character
+    prefix = ''
+    suffix = ''
+    if new_tag_builder[0] == '' and has_prev_sibling:
+        new_tag_builder = new_tag_builder[1:]
+        prefix = '\n'
+    if new_tag_builder[-1] == '' and has_next_sibling:
+        new_tag_builder = new_tag_builder[:-1]
+        suffix = '\n'
+    return prefix + LINE_SEPARATOR.join(new_tag_builder) + suffix
+
+def get_sibling_tags(parent: Tag) -> Dict[int, Tuple[int, bool, bool]]:
+    """Walks the children of parent once, and returns the index of each of them, and whether there
+    is a tag anywhere before and anywhere after it, keyed by the id of the child. This is the same
+    thing find_previous_sibling() and find_next_sibling() search for, which skip over strings.
+    """
+    children = parent.contents
+    last_tag = max((idx for idx, child in enumerate(children) if isinstance(child, Tag)), default=-1)
+    sibling_tags: Dict[int, Tuple[int, bool, bool]] = dict()
+    seen_tag = False
+    for idx, child in enumerate(children):
+        sibling_tags[id(child)] = (idx, seen_tag, idx < last_tag)
+        seen_tag = seen_tag or isinstance(child, Tag)
+    return sibling_tags
+
 def replace_newlines(article: Article) -> Article:
     """Replaces newlines with the Unicode LINE SEPARATOR character (U+2028). This preserves
     them in InDesign, which will treat newlines as paragraph breaks otherwise.
     """
     text_tag: bs4.NavigableString
-    for text_tag in article.content.find_all(text=True):
-        if not keep_verbatim(text_tag):
-            # Non-verbatim tags must be handled separately, and we must make sure it's not a
-            # double line-break (i.e. paragraph break). We also don't replace it if it's
-            # immediately before or after a tag
-            # FIXME: this is actually a hacky solution that can fail for poetry where a line ends
-            #        with a tag. Disambiguate between block and inline tags?
-            prev_sibling = text_tag.find_previous_sibling()
-            next_sibling = text_tag.find_next_sibling()
-            # Split along single line breaks
-            new_tag_builder = re.split('(?<!\n)\n(?!\n)', text_tag)
-            # Keep single line breaks that appear next to another tag, by throwing them out and
-            # manually placing a newline character
-            prefix = ''
-            suffix = ''
-            if new_tag_builder[0] == '' and prev_sibling != None:
-                new_tag_builder = new_tag_builder[1:]
-                prefix = '\n'
-            if new_tag_builder[-1] == '' and next_sibling != None:
-                new_tag_builder = new_tag_builder[:-1]
-                suffix = '\n'
-            new_tag = bs4.NavigableString(prefix + LINE_SEPARATOR.join(new_tag_builder) + suffix)
-            text_tag.replace_with(new_tag)
+    # id of a parent -> where each of its children is, and whether it has tags before and after it
+    parent_sibling_tags: Dict[int, Dict[int, Tuple[int, bool, bool]]] = dict()
+    for text_tag in article.content.find_all(string=True):
+        text = str(text_tag)
+        # separate_lines leaves anything without a line break as it is
+        if text and '\n' not in text: continue
+        if keep_verbatim(text_tag): continue
+        # Non-verbatim tags must be handled separately, and we must make sure it's not a
+        # double line-break (i.e. paragraph break). We also don't replace it if it's
+        # immediately before or after a tag
+        # FIXME: this is actually a hacky solution that can fail for poetry where a line ends
+        #        with a tag. Disambiguate between block and inline tags?
+        parent = text_tag.parent
+        if id(parent) not in parent_sibling_tags:
+            # this stays accurate, since we only ever swap one string for another
+            parent_sibling_tags[id(parent)] = get_sibling_tags(parent)
+        idx, has_prev_sibling, has_next_sibling = parent_sibling_tags[id(parent)][id(text_tag)]
+        new_text = separate_lines(text, has_prev_sibling, has_next_sibling)
+        if new_text != text:
+            # replace_with() would search the parent for text_tag again, but we know where it is
+            text_tag.extract(_self_index=idx)
+            parent.insert(idx, bs4.NavigableString(new_text))
     return article
 
 def add_footnotes(article: Article) -> Article:
-    """Replaces footnotes in <sup></sup> tags, [\d] format, or *, **, etc."""
-    text_tag: bs4.NavigableString
-    inline_regex = re.compile(r'\[(\d*)\]')
-    footnote_counter = 1  # is the expected number of the next footnote
-    for text_tag in article.content.find_all(text=True):
-        if keep_verbatim(text_tag): continue
-
-        for match in inline_regex.finditer(text_tag):
-            # Check match for provided numbering -- if it exists, then use it
-            footnote_num = footnote_counter
-            if len(match[1]):
-                footnote_num = int(match[1])
-            sup_tag = Tag(name='sup')
-            sup_tag.string = str(footnote_num)
-            text_tag = replace_text_with_tag(match[0], sup_tag, text_tag, article=article)
-            # Only auto-increment if blank or explicitly incremented
-            if len(match[1]) == 0 or footnote_num == footnote_counter:
-                footnote_counter += 1
-    return article
+    return convert_inline_markup(article, [InlineTokenType.Footnote])
 
 """POST_PROCESS is a list of functions that take Article instances and return Article instances.
 
@@ -544,10 +850,8 @@ Use this to make any changes to articles you need before export, as well as to g
 """
 POST_PROCESS: List[Callable[[Article], Article]] = [
     normalize_newlines,
-    convert_imgur_embeds,
+    convert_inline_markup,
     download_images,
-    compile_latex,
-    replace_inline_code,
     convert_manual_syntax_highlighting,
     format_code_blocks,
     replace_newlines,
@@ -558,6 +862,237 @@ POST_PROCESS: List[Callable[[Article], Article]] = [
     add_footnotes
 ]
 
+def profile_pass(process: Callable[[Article], Article], pass_times: Dict[str, float]) -> Callable[[Article], Article]:
+    """Wraps the post-process pass process so the time spent in it is added to pass_times,
+    and sent as a pass event.
+    """
+    def profiled_process(article: Article) -> Article:
+        start = time.perf_counter()
+        article = process(article)
+        elapsed = time.perf_counter() - start
+        pass_times[process.__name__] = pass_times.get(process.__name__, 0.0) + elapsed
+        emit('pass', name=process.__name__, article=article.title, seconds=elapsed)
+        return article
+    profiled_process.__name__ = process.__name__
+    return profiled_process
+
+def print_profile(pass_times: Dict[str, float]):
+    print('Time spent in each pass:')
+    for name, seconds in pass_times.items():
+        print(f'  {name:<36}{seconds * 1000:10.1f} ms')
+    print('Text transform caches:')
+    for name, hits, misses in get_transform_cache_stats():
+        calls = hits + misses
+        hit_rate = hits / calls if calls else 0.0
+        print(f'  {name:<36}{hits:8} hits {misses:8} misses {hit_rate:8.1%}')
+    highlight_cache = get_highlight_cache()
+    if highlight_cache is not None:
+        calls = highlight_cache.hits + highlight_cache.misses
+        hit_rate = highlight_cache.hits / calls if calls else 0.0
+        print(f'Highlight cache:\n  {"code blocks":<36}{highlight_cache.hits:8} hits {highlight_cache.misses:8} misses {hit_rate:8.1%}')
+
+def get_transform_cache_totals() -> Tuple[int, int]:
+    """Returns the hits and misses of every text transform cache added together.
+    """
+    stats = get_transform_cache_stats()
+    return sum(hits for _, hits, _ in stats), sum(misses for _, _, misses in stats)
+
+def start_article(article: Article) -> Article:
+    emit('article_start', title=article.title)
+    return article.parse()
+
+def iter_processed_articles(articles: List[Article], pass_times: Optional[Dict[str, float]] = None) -> Iterator[Tuple[Article, Element]]:
+    """Runs every pass in POST_PROCESS over articles, and yields each article along with its
+    <article> tag as soon as it's done. If pass_times is given, the time spent in each pass is
+    added to it. Progress is sent as events to anything listening.
+    """
+    export_start = time.perf_counter()
+    emit('export_start', articles=len(articles))
+    print('Indexing articles...', flush=True)
+    # this also starts compiling every formula in the issue in the background
+    for article in articles:
+        index_article(article)
+    resolve_index_embeds(articles)
+    emit('index_finish', seconds=time.perf_counter() - export_start)
+    print('Post-processing articles...', flush=True)
+    # per-pass times are only measured if someone is going to look at them
+    if pass_times is None and events.is_enabled():
+        pass_times = dict()
+    # articles are parsed lazily, so only the one currently being processed is held as a tree
+    processed = map(start_article, articles)
+    for process in POST_PROCESS:
+        print(f'Post-process pass: {process.__name__}', flush=True)
+        if pass_times is not None:
+            process = profile_pass(process, pass_times)
+        processed = map(process, processed)
+    print(f'Post-processing...', flush=True)
+    last_finish = time.perf_counter()
+    last_hits, last_misses = get_transform_cache_totals()
+    for article in processed:
+        article_tag = article.to_xml_element()
+        article.release()
+        # every pass runs on an article before the next one is started, so this is all of its time
+        finish = time.perf_counter()
+        hits, misses = get_transform_cache_totals()
+        emit('article_finish', title=article.title, seconds=finish - last_finish,
+            cache_hits=hits - last_hits, cache_misses=misses - last_misses)
+        yield article, article_tag
+        last_finish, last_hits, last_misses = time.perf_counter(), hits, misses
+    for name, hits, misses in get_transform_cache_stats():
+        emit('transform_cache', name=name, hits=hits, misses=misses)
+    highlight_cache = get_highlight_cache()
+    if highlight_cache is not None:
+        emit('highlight_cache', hits=highlight_cache.hits, misses=highlight_cache.misses, bytes=highlight_cache.total_size)
+    emit('export_finish', articles=len(articles), seconds=time.perf_counter() - export_start)
+
+def process_articles(articles: List[Article], pass_times: Optional[Dict[str, float]] = None) -> Element:
+    """Runs every pass in POST_PROCESS over articles, and returns an <issue> tag containing them.
+    If pass_times is given, the time spent in each pass is added to it.
+    """
+    root = Element('issue')
+    for _, article_tag in iter_processed_articles(articles, pass_times):
+        root.append(article_tag)
+    return root
+
+def finish_assets() -> Dict[str, LinkedAsset]:
+    """Waits for every download and LaTeX compile, then checks that every file the issue links to
+    exists. Anything missing is reported, and returned by path so restore_missing_links can take
+    the links to it back out of the output.
+    """
+    start = time.perf_counter()
+    print('Waiting for assets...', flush=True)
+    shutdown_download_service()
+    shutdown_latex_service()
+    links = take_links()
+    missing = links.check()
+    for asset, error in missing:
+        if isinstance(error, subprocess.TimeoutExpired):
+            reason = f'timed out after {error.timeout} seconds'
+        elif error is not None:
+            reason = str(error)
+        else:
+            reason = 'the file was never created'
+        print(f'Missing {asset.path} for {asset.source}. Reason: {reason}')
+    emit('assets_checked', linked=len(links.assets), missing=len(missing), seconds=time.perf_counter() - start)
+    if missing:
+        input("[Enter] to continue...")
+    return {asset.path: asset for asset, _ in missing}
+
+def format_xml(serialized: str) -> str:
+    """Turns serialized XML of an issue, or of an article on its own, into the text InDesign imports.
+    """
+    # Remove extraneous lines
+    transformed = "\n".join([line for line in html.unescape(serialized).split("\n") if line.strip() != ''])
+    # Separate articles cleanly
+    transformed = "</article>\n<article>".join([article for article in transformed.split("</article><article>")])
+    # Separate title, subtitle, and content cleanly
+    transformed = "</title>\n<content>".join([article for article in transformed.split("</title><content>")])
+    transformed = "</title>\n<subtitle>".join([article for article in transformed.split("</title><subtitle>")])
+    transformed = "</subtitle>\n<content>".join([article for article in transformed.split("</subtitle><content>")])
+    # Remove extraneous items from beginning and end of lists
+    transformed = "<ul>".join([thing for thing in transformed.split("<ul>\n")])
+    transformed = "</ul>".join([thing for thing in transformed.split("\n</ul>")])
+    transformed = "<ol>".join([thing for thing in transformed.split("<ol>\n")])
+    transformed = "</ol>".join([thing for thing in transformed.split("\n</ol>")])
+    return transformed
+
+def format_issue(root: Element) -> str:
+    """Serializes the <issue> tag root into the text InDesign imports.
+    """
+    return format_xml(ElementTree.tostring(root, encoding='unicode'))
+
+def get_article_filename(number: int, title: str) -> str:
+    """Returns the filename of the standalone XML file for the article numbered number, counting from 1.
+    """
+    slug = re.sub(r"\W", "", title[0:40].encode('ascii', errors='ignore').decode().replace(' ', '_'))
+    return f'{number:03}_{slug or "article"}.xml'
+
+class ShardedIssueWriter:
+    """Writes each article to its own shard file as soon as it's done, on a pool of workers, and
+    then merges the shards in issue order into the output file.
+
+    Only articles that haven't been written yet are held in memory. The shards are formatted on
+    their own, which gives the same text as formatting the whole issue at once, since the newline
+    rules never look across the boundary between two articles. If article_dir is given, each
+    article is also written there as an issue of its own, so it can be imported right away.
+    """
+
+    def __init__(self, output_path: str, article_dir: Optional[str] = None, max_workers: int = SHARD_WORKERS):
+        self.output_path = output_path
+        self.article_dir = article_dir
+        self.shard_dir = tempfile.TemporaryDirectory(prefix='prepress-shards-')
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shard')
+        self.shards: List[Future] = []
+        if article_dir is not None:
+            os.makedirs(article_dir, exist_ok=True)
+
+    def write_article(self, article_path: str, fragment: str):
+        # written under another name first, so a half-written article is never imported
+        with open(article_path + '.tmp', 'w', encoding='utf-8') as article_file:
+            article_file.write(f'<issue>{fragment}</issue>')
+        os.replace(article_path + '.tmp', article_path)
+
+    def write_shard(self, number: int, title: str, article_tag: Element) -> Tuple[str, Optional[str]]:
+        """Writes the shard, and the article on its own if there's an article_dir, and returns their paths.
+        """
+        fragment = format_xml(ElementTree.tostring(article_tag, encoding='unicode'))
+        shard_path = os.path.join(self.shard_dir.name, f'{number:05}.xml')
+        # shards are copied into the output as is, so newlines are only translated once
+        with open(shard_path, 'w', encoding='utf-8', newline='') as shard_file:
+            shard_file.write(fragment)
+        article_path = None
+        if self.article_dir is not None:
+            article_path = os.path.join(self.article_dir, get_article_filename(number, title))
+            self.write_article(article_path, fragment)
+        emit('shard_written', title=title, number=number, characters=len(fragment))
+        return shard_path, article_path
+
+    def add(self, article: Article, article_tag: Element):
+        number = len(self.shards) + 1
+        self.shards.append(self.executor.submit(self.write_shard, number, article.title, article_tag))
+
+    def merge(self, missing: Dict[str, LinkedAsset] = None):
+        """Waits for every shard and concatenates them, in the order they were added, into the output file.
+        Links to the assets in missing are taken back out of the output, and out of any article
+        that was written on its own.
+        """
+        self.executor.shutdown(wait=True)
+        # the output is replaced in one go, so a failed export leaves the last one alone
+        with open(self.output_path + '.tmp', 'w', encoding='utf-8') as output_file:
+            if not self.shards:
+                output_file.write(format_issue(Element('issue')))
+            else:
+                output_file.write('<issue>')
+                for idx, shard in enumerate(self.shards):
+                    if idx:
+                        output_file.write('\n')
+                    shard_path, article_path = shard.result()
+                    with open(shard_path, encoding='utf-8', newline='') as shard_file:
+                        if not missing:
+                            shutil.copyfileobj(shard_file, output_file)
+                            continue
+                        fragment = shard_file.read()
+                    restored = restore_missing_links(fragment, missing)
+                    output_file.write(restored)
+                    if article_path is not None and restored != fragment:
+                        self.write_article(article_path, restored)
+                output_file.write('</issue>')
+        os.replace(self.output_path + '.tmp', self.output_path)
+        self.shard_dir.cleanup()
+
+def write_sharded_issue(articles: List[Article], output_path: str, article_dir: Optional[str] = None,
+        pass_times: Optional[Dict[str, float]] = None):
+    """Processes articles like process_articles, but writes them out through a ShardedIssueWriter
+    instead of building the whole issue in memory. Waits for assets with finish_assets before
+    the shards are merged.
+    """
+    writer = ShardedIssueWriter(output_path, article_dir)
+    for article, article_tag in iter_processed_articles(articles, pass_times):
+        writer.add(article, article_tag)
+    missing = finish_assets()
+    print(f'Merging articles into {output_path}...', flush=True)
+    writer.merge(missing)
+
 def create_asset_dirs():
     if not os.path.isdir(os.path.join(ASSET_DIR, 'img')):
         os.makedirs(os.path.join(ASSET_DIR, 'img'))
@@ -574,7 +1109,26 @@ if __name__ == "__main__":
     parser.add_argument('-a', '--assets',
         help='a folder to store asset files to',
         default='assets')
+    parser.add_argument('-p', '--profile',
+        help='print the time spent in each pass and text transform cache hit rates',
+        action='store_true')
+    parser.add_argument('-e', '--events',
+        help='write progress and metrics events as JSON lines to this file, or to fd:N for a file descriptor that is already open')
+    parser.add_argument('--progress',
+        help='print how far along the export is, with an ETA, after every article',
+        action='store_true')
+    parser.add_argument('-s', '--sharded',
+        help='write each article out as soon as it is done, and merge them into the output at the end',
+        action='store_true')
+    parser.add_argument('--article_dir',
+        help='also write each article to this folder as its own XML file as soon as it is done (implies --sharded)')
     args = parser.parse_args()
+    events_file = None
+    if args.events:
+        events_file = open_event_file(args.events)
+        events.add_listener(JsonLinesWriter(events_file))
+    if args.progress:
+        events.add_listener(ProgressSummary())
     CURRENT_DIR = os.getcwd()
     if os.path.isabs(args.assets):
         ASSET_DIR = args.assets
@@ -586,34 +1140,22 @@ if __name__ == "__main__":
     if not os.path.isfile(args.xml_dump):
         print(f'{args.xml_dump} does not exist.')
         exit(1)
-    print('Parsing XML...', flush=True)
-    tree = ElementTree.parse(args.xml_dump)
-    print('Filtering articles...', flush=True)
-    articles = filter_articles(tree, args.issue)
-    print('Post-processing articles...', flush=True)
-    for process in POST_PROCESS:
-        print(f'Post-process pass: {process.__name__}', flush=True)
-        articles = map(process, articles)
-    print(f'Post-processing...', flush=True)
-    root = Element('issue')
-    for article in articles:
-        root.append(article.to_xml_element())
-    print(f'Writing to {OUTPUT_FILE}...', flush=True)
-    os.chdir(CURRENT_DIR)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as output_file:
-        # do some processing first
-        # Remove extraneous lines
-        transformed = "\n".join([line for line in html.unescape(ElementTree.tostring(root, encoding='unicode')).split("\n") if line.strip() != ''])
-        # Separate articles cleanly
-        transformed = "</article>\n<article>".join([article for article in transformed.split("</article><article>")])
-        # Separate title, subtitle, and content cleanly
-        transformed = "</title>\n<content>".join([article for article in transformed.split("</title><content>")])
-        transformed = "</title>\n<subtitle>".join([article for article in transformed.split("</title><subtitle>")])
-        transformed = "</subtitle>\n<content>".join([article for article in transformed.split("</subtitle><content>")])
-        # Remove extraneous items from beginning and end of lists
-        transformed = "<ul>".join([thing for thing in transformed.split("<ul>\n")])
-        transformed = "</ul>".join([thing for thing in transformed.split("\n</ul>")])
-        transformed = "<ol>".join([thing for thing in transformed.split("<ol>\n")])
-        transformed = "</ol>".join([thing for thing in transformed.split("\n</ol>")])
-        output_file.write(transformed)
+    print('Reading XML...', flush=True)
+    # only items that mention the issue are parsed, so the rest of the dump is never loaded
+    articles = filter_items(read_tagged_items(args.xml_dump, args.issue), args.issue)
+    pass_times: Dict[str, float] = dict()
+    if args.sharded or args.article_dir:
+        write_sharded_issue(articles, OUTPUT_FILE, args.article_dir, pass_times if args.profile else None)
+    else:
+        root = process_articles(articles, pass_times if args.profile else None)
+        # downloads and compiles ran alongside the passes, anything that failed is put back as it was
+        missing = finish_assets()
+        print(f'Writing to {OUTPUT_FILE}...', flush=True)
+        os.chdir(CURRENT_DIR)
+        with open(OUTPUT_FILE, 'w', encoding='utf-8') as output_file:
+            output_file.write(restore_missing_links(format_issue(root), missing))
     print('Issue written.')
+    if args.profile:
+        print_profile(pass_times)
+    if events_file is not None:
+        events_file.close()
@@ -0,0 +1,105 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from bs4 import BeautifulSoup
+
+import prepress
+from plugins.assets import AssetLinks, AssetService, restore_missing_links
+from prepress import Article
+from util import html_escape
+
+
+class TestAssetService(unittest.TestCase):
+
+    def setUp(self):
+        self.service = AssetService(max_workers=2, thread_name_prefix='test')
+        self.addCleanup(self.service.shutdown)
+
+    def test_produced_once(self):
+        calls = []
+        first = self.service.submit('a.png', calls.append, 'first')
+        second = self.service.submit('a.png', calls.append, 'second')
+        self.assertIs(first, second)
+        self.service.shutdown()
+        self.assertEqual(calls, ['first'])
+
+    def test_links_added_before_files_exist(self):
+        release = threading.Event()
+        # cleanups run last in first, so a failing test can't leave the worker waiting on shutdown
+        self.addCleanup(release.set)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'slow.png')
+
+            def produce():
+                release.wait()
+                open(path, 'w').close()
+
+            links = AssetLinks()
+            href = links.add(path, self.service.submit(path, produce), 'https://example.com/slow.png', '<img/>')
+            self.assertEqual(href, 'file://' + path)
+            self.assertFalse(os.path.exists(path))
+            release.set()
+            self.assertEqual(links.check(), [])
+
+    def test_check_reports_missing(self):
+        def fail():
+            raise OSError('no space left')
+
+        links = AssetLinks()
+        links.add('/nonexistent/failed.pdf', self.service.submit('failed', fail), r'\frac12', r'\(\frac12\)')
+        links.add('/nonexistent/forgot.pdf', self.service.submit('forgot', lambda: None), r'x^2', r'\(x^2\)')
+        missing = links.check()
+        self.assertEqual([asset.source for asset, _ in missing], [r'\frac12', 'x^2'])
+        self.assertIsInstance(missing[0][1], OSError)
+        self.assertIsNone(missing[1][1])
+
+    def test_restore_missing_links(self):
+        links = AssetLinks()
+        failed = links.add('/a&b/failed.pdf', self.service.submit('failed', lambda: None), 'x < y', r'\(x &lt; y\)')
+        kept = links.add('/assets/kept.pdf', self.service.submit('kept', lambda: None), 'z', r'\(z\)')
+        text = f'<p>A <link href="{html_escape(failed)}"/> and <link href="{kept}"/> and <link href="{html_escape(failed)}"></link></p>'
+        missing = {'/a&b/failed.pdf': links.assets['/a&b/failed.pdf']}
+        self.assertEqual(restore_missing_links(text, missing),
+            f'<p>A \\(x &lt; y\\) and <link href="{kept}"/> and \\(x &lt; y\\)</p>')
+        self.assertIs(restore_missing_links(text, {}), text)
+
+
+class TestDownloadImages(unittest.TestCase):
+
+    def test_failed_download(self):
+        def urlretrieve(url: str, filename: str):
+            raise urllib.error.HTTPError(url, 404, 'Not Found', {}, None)
+
+        article = Article()
+        article.title = 'Broken image'
+        article.content = BeautifulSoup('<p><img alt="Gone" src="https://example.com/gone.png"/></p>', 'html.parser')
+        original = str(article.content)
+        prompts = []
+        with tempfile.TemporaryDirectory() as asset_dir, \
+                mock.patch.object(prepress, 'ASSET_DIR', asset_dir), \
+                mock.patch.object(urllib.request, 'urlretrieve', urlretrieve), \
+                mock.patch('builtins.input', prompts.append), \
+                contextlib.redirect_stdout(io.StringIO()) as output:
+            prepress.create_asset_dirs()
+            prepress.download_images(article)
+            # the link goes in whether or not the download works out
+            link = article.content.find('link')
+            self.assertEqual(link['href'], 'file://' + os.path.join(asset_dir, 'img', 'Broken_ima_gone.png'))
+            missing = prepress.finish_assets()
+            self.assertEqual(list(missing), [link['href'][len('file://'):]])
+            # the image goes back to how it was before the download was planned
+            self.assertEqual(restore_missing_links(str(article.content), missing), original)
+        self.assertIn('Missing', output.getvalue())
+        self.assertIn('https://example.com/gone.png', output.getvalue())
+        self.assertEqual(len(prompts), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import random
+import re
+import unittest
+
+from prepress import dashify
+
+# Every character the dash rules care about, plus a few they must leave alone
+ALPHABET = [' ', ' ', '-', '-', '—', '–', '\u2009', '1', '9', 'a', 'Z', '\n', '.', '٣']
+
+
+def reference_dashify(text: str) -> str:
+    """The chain of substitutions replace_dashes used to run on every text node.
+    """
+    return re.sub(r'(?<=\d) ?--? ?(?=\d)', '–', text) \
+        .replace(' - ', '—') \
+        .replace(' --- ', '—') \
+        .replace('---', '—') \
+        .replace(' -- ', '—') \
+        .replace('--', '—') \
+        .replace(' — ', '—') \
+        .replace('—', ' — ')
+
+
+class TestDashes(unittest.TestCase):
+
+    def test_examples(self):
+        self.assertEqual(dashify('pages 3-5'), 'pages 3–5')
+        self.assertEqual(dashify('pages 3 -- 5'), 'pages 3–5')
+        self.assertEqual(dashify('wait - what'), 'wait\u2009—\u2009what')
+        self.assertEqual(dashify('wait---what'), 'wait\u2009—\u2009what')
+        self.assertEqual(dashify('wait — what'), 'wait\u2009—\u2009what')
+        self.assertEqual(dashify('well-known'), 'well-known')
+        self.assertEqual(dashify('no dashes here'), 'no dashes here')
+
+    def test_matches_reference(self):
+        # property: for any string, the single-pass engine agrees with the old chain of replaces
+        rng = random.Random(20201014)
+        for _ in range(20000):
+            text = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 16)))
+            self.assertEqual(dashify.__wrapped__(text), reference_dashify(text), repr(text))
+
+    def test_matches_reference_exhaustive(self):
+        # every short string over the characters that interact
+        alphabet = [' ', '-', '—', '1', 'a']
+        texts = ['']
+        for _ in range(6):
+            texts = [text + char for text in texts for char in alphabet]
+            for text in texts:
+                self.assertEqual(dashify.__wrapped__(text), reference_dashify(text), repr(text))
@@ -0,0 +1,102 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+import prepress
+from plugins import events
+from plugins.events import JsonLinesWriter, ProgressSummary, emit, open_event_file
+from plugins.wxr import read_tagged_items
+from tests.test_golden import FIXTURES, OfflineRecorder
+
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.received = []
+        events.add_listener(self.received.append)
+        self.addCleanup(events.remove_listener, self.received.append)
+
+    def test_emit(self):
+        emit('pass', name='replace_dashes', seconds=0.5)
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.received[0]['event'], 'pass')
+        self.assertEqual(self.received[0]['name'], 'replace_dashes')
+        self.assertIn('time', self.received[0])
+
+    def test_json_lines(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'events.jsonl')
+            with open_event_file(path) as events_file:
+                writer = JsonLinesWriter(events_file)
+                writer({'time': 1.0, 'event': 'article_start', 'title': 'Ünïcode'})
+                writer({'time': 2.0, 'event': 'article_finish', 'title': 'Ünïcode'})
+            with open(path, encoding='utf-8') as events_file:
+                lines = [json.loads(line) for line in events_file]
+        self.assertEqual([line['event'] for line in lines], ['article_start', 'article_finish'])
+        self.assertEqual(lines[0]['title'], 'Ünïcode')
+
+    def test_file_descriptor(self):
+        read_fd, write_fd = os.pipe()
+        with open_event_file(f'fd:{write_fd}') as events_file:
+            JsonLinesWriter(events_file)({'time': 1.0, 'event': 'export_start'})
+        # the descriptor belongs to whoever passed it in, so it stays open
+        os.close(write_fd)
+        with open(read_fd, encoding='utf-8') as read_file:
+            self.assertEqual(json.loads(read_file.read())['event'], 'export_start')
+
+    def test_pipeline_events(self):
+        fixture = FIXTURES[1]
+        with tempfile.TemporaryDirectory() as asset_dir, \
+                mock.patch.object(prepress, 'ASSET_DIR', asset_dir), \
+                contextlib.redirect_stdout(io.StringIO()):
+            prepress.create_asset_dirs()
+            with OfflineRecorder(asset_dir).patched():
+                articles = prepress.filter_items(read_tagged_items(fixture.xml_dump, fixture.issue), fixture.issue)
+                prepress.process_articles(articles)
+                prepress.finish_assets()
+        kinds = Counter(event['event'] for event in self.received)
+        self.assertEqual(kinds['export_start'], 1)
+        self.assertEqual(kinds['export_finish'], 1)
+        self.assertEqual(kinds['article_start'], len(articles))
+        self.assertEqual(kinds['article_finish'], len(articles))
+        self.assertEqual(kinds['pass'], len(articles) * len(prepress.POST_PROCESS))
+        self.assertGreater(kinds['download'], 0)
+        self.assertGreater(kinds['latex_compile'], 0)
+        for event in self.received:
+            if event['event'] == 'download':
+                self.assertGreater(event['bytes'], 0)
+
+
+class TestProgressSummary(unittest.TestCase):
+
+    def test_eta(self):
+        lines = []
+        progress = ProgressSummary(lines.append)
+        progress({'time': 100.0, 'event': 'export_start', 'articles': 4})
+        progress({'time': 101.0, 'event': 'download', 'bytes': 2500000})
+        progress({'time': 101.0, 'event': 'latex_compile', 'seconds': 0.25, 'ok': True})
+        progress({'time': 110.0, 'event': 'article_finish'})
+        self.assertEqual(progress.get_eta(110.0), 30.0)
+        progress({'time': 111.0, 'event': 'latex_compile', 'seconds': 0.5, 'ok': False})
+        progress({'time': 120.0, 'event': 'article_finish'})
+        self.assertEqual(progress.get_eta(120.0), 20.0)
+        self.assertEqual(lines, [
+            '[1/4 articles] 10s elapsed, ETA 30s, 2.5 MB downloaded, 1 formulas compiled in 0.2s',
+            '[2/4 articles] 20s elapsed, ETA 20s, 2.5 MB downloaded, 1 formulas compiled, 1 failed in 0.8s',
+        ])
+
+    def test_no_articles_yet(self):
+        progress = ProgressSummary(lambda line: None)
+        progress({'time': 100.0, 'event': 'export_start', 'articles': 90})
+        self.assertIsNone(progress.get_eta(200.0))
+        self.assertEqual(progress.summarize(190.0),
+            '[0/90 articles] 1m30s elapsed, ETA ?, 0.0 MB downloaded, 0 formulas compiled in 0.0s')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from xml.etree import ElementTree
+
+from prepress import filter_articles, scan_item
+
+DUMP = '''<rss xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:wp="http://wordpress.org/export/1.2/">
+<channel>
+    <item>
+        <title>Approved</title>
+        <content:encoded><![CDATA[Some <em>content</em>]]></content:encoded>
+        <category domain="category" nicename="editor-okayed"><![CDATA[Editor okayed]]></category>
+        <category domain="post_tag" nicename="v1i1"><![CDATA[v1i1]]></category>
+        <wp:postmeta>
+            <wp:meta_key><![CDATA[mn_author]]></wp:meta_key>
+            <wp:meta_value><![CDATA[someone]]></wp:meta_value>
+        </wp:postmeta>
+        <wp:postmeta>
+            <wp:meta_key><![CDATA[mn_subtitle]]></wp:meta_key>
+            <wp:meta_value><![CDATA[A subtitle]]></wp:meta_value>
+        </wp:postmeta>
+    </item>
+    <item>
+        <title>Not approved</title>
+        <content:encoded><![CDATA[Nope]]></content:encoded>
+        <category domain="post_tag" nicename="v1i1"><![CDATA[v1i1]]></category>
+    </item>
+    <item>
+        <title>Other issue</title>
+        <content:encoded><![CDATA[Nope]]></content:encoded>
+        <category domain="category" nicename="editor-okayed"><![CDATA[Editor okayed]]></category>
+        <category domain="post_tag" nicename="v1i2"><![CDATA[v1i2]]></category>
+    </item>
+</channel>
+</rss>'''
+
+
+class TestFilterArticles(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = ElementTree.ElementTree(ElementTree.fromstring(DUMP))
+
+    def test_scan_item(self):
+        item = scan_item(next(self.tree.getroot().iter('item')))
+        self.assertEqual(item.title, 'Approved')
+        self.assertEqual(item.content, 'Some <em>content</em>')
+        self.assertEqual(item.categories, [('category', 'Editor okayed'), ('post_tag', 'v1i1')])
+        self.assertEqual(item.post_meta, [('mn_author', 'someone'), ('mn_subtitle', 'A subtitle')])
+
+    def test_filter(self):
+        articles = filter_articles(self.tree, 'v1i1')
+        self.assertEqual([article.title for article in articles], ['Approved'])
+        self.assertEqual(articles[0].author, 'someone')
+        self.assertEqual(articles[0].subtitle, 'A subtitle')
+        self.assertEqual(articles[0].raw_content, 'Some <em>content</em>')
@@ -0,0 +1,259 @@
+"""Runs the whole pipeline offline on fixture dumps and compares the output with stored goldens.
+
+Network access, pdflatex and prompts are stubbed out, and every call to them is recorded in the
+asset manifest next to the files that ended up in the asset directory. Run
+`python -m tests.test_golden` to see per-fixture timings, or `python -m tests.test_golden --update`
+to rewrite the goldens after an intended change in output.
+"""
+import argparse
+import builtins
+import contextlib
+import difflib
+import hashlib
+import io
+import json
+import os
+import os.path
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, NamedTuple, Tuple
+from unittest import mock
+
+from PIL import Image
+
+import plugins.highlight_cache
+import plugins.latex
+import prepress
+from plugins.assets import restore_missing_links
+from plugins.latex import BEGIN_DOCUMENT
+from plugins.wxr import read_tagged_items
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(TESTS_DIR, 'golden')
+# Stands in for the asset directory, which is different on every run
+ASSET_PLACEHOLDER = '{assets}'
+# Escaped braces, which don't open or close a group
+ESCAPED_BRACE_REGEX = re.compile(r'\\[{}]')
+
+
+class GoldenFixture(NamedTuple):
+    name: str
+    xml_dump: str
+    issue: str
+
+    @property
+    def golden_output(self) -> str:
+        return os.path.join(GOLDEN_DIR, self.name + '.issue.xml')
+
+    @property
+    def golden_manifest(self) -> str:
+        return os.path.join(GOLDEN_DIR, self.name + '.manifest.json')
+
+
+FIXTURES = [
+    GoldenFixture('test-export', os.path.join(TESTS_DIR, 'test-export.xml'), 'v1xxiy'),
+    GoldenFixture('markup-export', os.path.join(GOLDEN_DIR, 'markup-export.xml'), 'v1i1'),
+    # formulas and images that fail, with markup that has to stay escaped when they go back in
+    GoldenFixture('failed-assets-export', os.path.join(GOLDEN_DIR, 'failed-assets-export.xml'), 'v1i2'),
+]
+
+
+def is_rejected(body: str) -> bool:
+    """Returns True for the mistakes in formulas pdflatex stops at: unbalanced braces, and text mode
+    commands like \\LaTeX, which every formula is too deep in math mode for.
+    """
+    depth = 0
+    for char in ESCAPED_BRACE_REGEX.sub('', body):
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth < 0:
+                return True
+    return depth != 0 or r'\LaTeX' in body
+
+
+class FakeResponse(io.BytesIO):
+
+    def getcode(self) -> int:
+        return 200
+
+
+class OfflineRecorder:
+    """Stands in for everything the pipeline would reach outside of the process for, and records each call.
+    """
+
+    def __init__(self, asset_dir: str):
+        self.asset_dir = asset_dir
+        self.calls: List[List[str]] = []
+        self.lock = threading.Lock()
+
+    def relative(self, path: str) -> str:
+        return path.replace(self.asset_dir, ASSET_PLACEHOLDER)
+
+    def record(self, *call: str):
+        with self.lock:
+            self.calls.append(list(call))
+
+    def urlretrieve(self, url: str, filename: str):
+        self.record('download', url, self.relative(filename))
+        if 'missing' in url:
+            raise urllib.error.HTTPError(url, 404, 'Not Found', {}, None)
+        # a different, but reproducible size for every image
+        digest = hashlib.sha1(url.encode('utf-8')).digest()
+        Image.new('RGB', (100 + digest[0] * 8, 100 + digest[1] * 8), (digest[2], digest[3], digest[4])).save(filename, 'PNG')
+        return filename, None
+
+    def urlopen(self, url: str, *args, **kwargs):
+        self.record('fetch', url)
+        if 'missing' in url:
+            raise urllib.error.HTTPError(url, 404, 'Not Found', {}, None)
+        img_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+        return FakeResponse(f'<div id="image"><img class="post" src="https://i.imgur.com/{img_hash}.jpg"></div>'.encode('utf-8'))
+
+    def run_compiler(self, source: str, filename: str, *args, **kwargs):
+        body = source[source.index(BEGIN_DOCUMENT):]
+        if is_rejected(body):
+            self.record('compile-failed', self.relative(filename), body)
+            raise subprocess.CalledProcessError(1, plugins.latex.LATEX_COMPILER)
+        self.record('compile', self.relative(filename), body)
+        with open(filename + '.pdf', 'w', encoding='utf-8') as pdf_file:
+            pdf_file.write(body)
+
+    def input(self, prompt: str = '') -> str:
+        self.record('prompt', prompt)
+        return ''
+
+    @contextlib.contextmanager
+    def patched(self):
+        with mock.patch.object(urllib.request, 'urlretrieve', self.urlretrieve), \
+                mock.patch.object(urllib.request, 'urlopen', self.urlopen), \
+                mock.patch.object(plugins.latex, 'run_compiler', self.run_compiler), \
+                mock.patch.object(plugins.latex, 'USE_PRECOMPILED_FORMAT', False), \
+                mock.patch.object(plugins.highlight_cache, 'USE_HIGHLIGHT_CACHE', False), \
+                mock.patch.object(builtins, 'input', self.input):
+            yield
+
+
+def describe_asset(path: str) -> Any:
+    if path.endswith('.pdf'):
+        with open(path, 'rb') as pdf_file:
+            return hashlib.sha1(pdf_file.read()).hexdigest()
+    with Image.open(path) as image:
+        return list(image.size)
+
+
+def build_manifest(asset_dir: str, recorder: OfflineRecorder) -> Dict[str, Any]:
+    assets = dict()
+    for dir_path, _, filenames in os.walk(asset_dir):
+        for filename in filenames:
+            path = os.path.join(dir_path, filename)
+            assets[os.path.relpath(path, asset_dir).replace(os.sep, '/')] = describe_asset(path)
+    # calls happen on worker threads too, so their order isn't meaningful
+    return {'assets': assets, 'calls': sorted(recorder.calls)}
+
+
+def run_fixture(fixture: GoldenFixture, article_dir: str = None) -> Tuple[str, str, float]:
+    """Runs the pipeline on fixture, and returns its output, its asset manifest and the seconds it took.
+    If article_dir is given, the issue is written out in sharded mode, with every article in article_dir too.
+    """
+    with tempfile.TemporaryDirectory() as asset_dir, \
+            mock.patch.object(prepress, 'ASSET_DIR', asset_dir), \
+            contextlib.redirect_stdout(io.StringIO()):
+        recorder = OfflineRecorder(asset_dir)
+        prepress.create_asset_dirs()
+        with recorder.patched():
+            start = time.perf_counter()
+            articles = prepress.filter_items(read_tagged_items(fixture.xml_dump, fixture.issue), fixture.issue)
+            if article_dir is None:
+                root = prepress.process_articles(articles)
+                output = restore_missing_links(prepress.format_issue(root), prepress.finish_assets())
+            else:
+                with tempfile.TemporaryDirectory() as output_dir:
+                    output_path = os.path.join(output_dir, 'issue.xml')
+                    prepress.write_sharded_issue(articles, output_path, article_dir)
+                    with open(output_path, encoding='utf-8', newline='') as output_file:
+                        output = output_file.read()
+                for filename in os.listdir(article_dir):
+                    article_path = os.path.join(article_dir, filename)
+                    write_golden(article_path, recorder.relative(read_golden(article_path)))
+            elapsed = time.perf_counter() - start
+        manifest = json.dumps(build_manifest(asset_dir, recorder), indent=1, sort_keys=True, ensure_ascii=False) + '\n'
+        return recorder.relative(output), manifest, elapsed
+
+
+def read_golden(path: str) -> str:
+    with open(path, encoding='utf-8', newline='') as golden_file:
+        return golden_file.read()
+
+
+def write_golden(path: str, contents: str):
+    with open(path, 'w', encoding='utf-8', newline='') as golden_file:
+        golden_file.write(contents)
+
+
+def diff(expected: str, actual: str, name: str) -> str:
+    return ''.join(difflib.unified_diff(
+        expected.splitlines(keepends=True), actual.splitlines(keepends=True), f'golden/{name}', name))
+
+
+class TestGoldenOutput(unittest.TestCase):
+    timings: Dict[str, float] = dict()
+
+    @classmethod
+    def tearDownClass(cls):
+        for name, elapsed in cls.timings.items():
+            print(f'\n{name:20} {elapsed:8.3f} s', end='')
+        print()
+
+    def check_fixture(self, fixture: GoldenFixture):
+        output, manifest, elapsed = run_fixture(fixture)
+        self.timings[fixture.name] = elapsed
+        for golden_path, actual in [(fixture.golden_output, output), (fixture.golden_manifest, manifest)]:
+            expected = read_golden(golden_path)
+            if expected != actual:
+                self.fail(f'{os.path.basename(golden_path)} differs from its golden:\n'
+                    + diff(expected, actual, os.path.basename(golden_path)))
+
+    def test_fixtures(self):
+        for fixture in FIXTURES:
+            with self.subTest(fixture.name):
+                self.check_fixture(fixture)
+
+    def test_sharded(self):
+        for fixture in FIXTURES:
+            with self.subTest(fixture.name), tempfile.TemporaryDirectory() as article_dir:
+                output, manifest, _ = run_fixture(fixture, article_dir)
+                self.assertEqual(output, read_golden(fixture.golden_output))
+                self.assertEqual(manifest, read_golden(fixture.golden_manifest))
+                # every article on its own is an issue with just that article in it
+                articles = []
+                for filename in sorted(os.listdir(article_dir)):
+                    article = read_golden(os.path.join(article_dir, filename))
+                    self.assertTrue(article.startswith('<issue><article>') and article.endswith('</article></issue>'))
+                    articles.append(article[len('<issue>'):-len('</issue>')])
+                self.assertEqual('<issue>' + '\n'.join(articles) + '</issue>', output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check or update the golden outputs')
+    parser.add_argument('-u', '--update', action='store_true', help='overwrite the goldens with the current output')
+    args = parser.parse_args()
+
+    for fixture in FIXTURES:
+        output, manifest, elapsed = run_fixture(fixture)
+        if args.update:
+            write_golden(fixture.golden_output, output)
+            write_golden(fixture.golden_manifest, manifest)
+            result = 'updated'
+        elif read_golden(fixture.golden_output) == output and read_golden(fixture.golden_manifest) == manifest:
+            result = 'ok'
+        else:
+            result = 'DIFFERS'
+        print(f'{fixture.name:20} {result:8} {elapsed:8.3f} s')
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pygments
+
+import plugins.highlight_cache
+import prepress
+from plugins import preformatted
+from plugins.highlight_cache import HighlightCache, get_cache_key, get_style_fingerprint
+from plugins.syntax_highlighting import IndFormatter
+from plugins.wxr import read_tagged_items
+from tests.test_golden import TESTS_DIR
+
+CODE = 'def f(x):\n    return x + 1'
+OPTIONS = {'lang': 'python', 'linenos': True}
+
+
+class TestCacheKey(unittest.TestCase):
+
+    def tearDown(self):
+        get_style_fingerprint.cache_clear()
+
+    def test_same_block(self):
+        self.assertEqual(get_cache_key(CODE, OPTIONS), get_cache_key(CODE, dict(reversed(list(OPTIONS.items())))))
+
+    def test_changes(self):
+        key = get_cache_key(CODE, OPTIONS)
+        self.assertNotEqual(key, get_cache_key(CODE + ' ', OPTIONS))
+        self.assertNotEqual(key, get_cache_key(CODE, {'lang': 'python'}))
+        with mock.patch.object(preformatted, 'MAX_PRE_LINE_LENGTH', 60):
+            self.assertNotEqual(key, get_cache_key(CODE, OPTIONS))
+        with mock.patch.object(preformatted, 'HIGHLIGHT_STYLE', 'default'):
+            self.assertNotEqual(key, get_cache_key(CODE, OPTIONS))
+        with mock.patch.object(pygments, '__version__', '0.0'):
+            self.assertNotEqual(key, get_cache_key(CODE, OPTIONS))
+
+    def test_style_mapping(self):
+        key = get_cache_key(CODE, OPTIONS)
+        original_init = IndFormatter.__init__
+
+        def init_without_italics(formatter, **options):
+            original_init(formatter, **options)
+            formatter.styles = {token: ('', '') if 'em>' in start else (start, end)
+                for token, (start, end) in formatter.styles.items()}
+
+        get_style_fingerprint.cache_clear()
+        with mock.patch.object(IndFormatter, '__init__', init_without_italics):
+            self.assertNotEqual(key, get_cache_key(CODE, OPTIONS))
+
+
+class TestHighlightCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_round_trip(self):
+        cache = HighlightCache(self.tmp_dir.name)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', '<pre><code>é</code></pre>')
+        self.assertEqual(cache.get('a'), '<pre><code>é</code></pre>')
+        # a later run sees what this one left behind
+        self.assertEqual(HighlightCache(self.tmp_dir.name).get('a'), '<pre><code>é</code></pre>')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = HighlightCache(self.tmp_dir.name, max_size=20)
+        cache.put('a', 'a' * 8)
+        cache.put('b', 'b' * 8)
+        cache.get('a')
+        cache.put('c', 'c' * 8)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.total_size, 16)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['a.html', 'c.html'])
+        self.assertEqual(HighlightCache(self.tmp_dir.name).load_entries().keys(), {'a', 'c'})
+
+
+class TestFormatCodeBlocks(unittest.TestCase):
+
+    def format_articles(self, cache: HighlightCache) -> str:
+        issue = 'v1xxiy'
+        articles = prepress.filter_items(read_tagged_items(os.path.join(TESTS_DIR, 'test-export.xml'), issue), issue)
+        with mock.patch.object(plugins.highlight_cache, 'USE_HIGHLIGHT_CACHE', cache is not None), \
+                mock.patch.object(plugins.highlight_cache, '_cache', cache):
+            return ''.join(str(prepress.format_code_blocks(article.parse()).content) for article in articles)
+
+    def test_warm_cache(self):
+        expected = self.format_articles(None)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cold = HighlightCache(cache_dir)
+            self.assertEqual(self.format_articles(cold), expected)
+            self.assertGreater(cold.misses, 0)
+            warm = HighlightCache(cache_dir)
+            self.assertEqual(self.format_articles(warm), expected)
+            self.assertEqual((warm.hits, warm.misses), (cold.misses, 0))
+
+    def test_wrap_length_invalidates(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.format_articles(HighlightCache(cache_dir))
+            with mock.patch.object(preformatted, 'MAX_PRE_LINE_LENGTH', 30):
+                cache = HighlightCache(cache_dir)
+                self.format_articles(cache)
+            self.assertEqual(cache.hits, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import http.client
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from plugins import imgur
+
+EMBED_PAGE = '''<html><head><link rel="stylesheet" href="embed.css"/></head>
+<body><img class="post" src="//i.imgur.com/WRONGxx.png">
+<div id="image"><div class="wrapper"><br>
+<img class="thumb post" src="//i.imgur.com/{hash}h.jpg" />
+</div></div></body></html>'''
+
+
+class FakeImgurHandler(BaseHTTPRequestHandler):
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = FakeImgurHandler
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.in_flight -= 1
+
+        img_hash = self.path.strip('/').split('/')[-2]
+        if img_hash.startswith('missing'):
+            self.send_error(404)
+            return
+        body = EMBED_PAGE.format(hash=img_hash)
+        if img_hash.startswith('noimage'):
+            body = '<html><body><p>Nothing here</p></body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if img_hash.startswith('cutoff'):
+            # the connection drops in the middle of a chunk, before the image turns up
+            data = body.encode('utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data[:len(data) // 4])
+            self.close_connection = True
+            return
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestImgurEmbeds(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeImgurHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.old_templ = imgur.IMGUR_EMBED_URL_TEMPL
+        imgur.IMGUR_EMBED_URL_TEMPL = f'http://127.0.0.1:{cls.server.server_port}/{{scheme}}{{hash}}/embed?pub=true'
+
+    @classmethod
+    def tearDownClass(cls):
+        imgur.IMGUR_EMBED_URL_TEMPL = cls.old_templ
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_parser_finds_image_inside_container(self):
+        parser = imgur.EmbedImageParser()
+        parser.feed(EMBED_PAGE.format(hash='abcde'))
+        self.assertEqual(parser.src, '//i.imgur.com/abcdeh.jpg')
+
+    def test_resolve(self):
+        resolved = imgur.resolve_embeds([('', 'abcde'), ('a/', 'fghij')])
+        self.assertEqual(resolved[('', 'abcde')], 'https://i.imgur.com/abcde.jpg')
+        self.assertEqual(resolved[('a/', 'fghij')], 'https://i.imgur.com/fghij.jpg')
+
+    def test_errors(self):
+        resolved = imgur.resolve_embeds([('', 'missing'), ('', 'noimage')])
+        self.assertIsInstance(resolved[('', 'missing')], Exception)
+        self.assertIsInstance(resolved[('', 'noimage')], ValueError)
+
+    def test_dropped_connection(self):
+        resolved = imgur.resolve_embeds([('', 'cutoff'), ('', 'abcde')])
+        self.assertIsInstance(resolved[('', 'cutoff')], http.client.HTTPException)
+        self.assertEqual(resolved[('', 'abcde')], 'https://i.imgur.com/abcde.jpg')
+
+    def test_per_host_limit(self):
+        FakeImgurHandler.max_in_flight = 0
+        keys = [('', f'hash{i:02}x') for i in range(imgur.MAX_CONNECTIONS_PER_HOST * 3)]
+        resolved = imgur.resolve_embeds(keys)
+        self.assertEqual(len(resolved), len(keys))
+        self.assertTrue(all(isinstance(url, str) for url in resolved.values()))
+        self.assertLessEqual(FakeImgurHandler.max_in_flight, imgur.MAX_CONNECTIONS_PER_HOST)
+        self.assertGreater(FakeImgurHandler.max_in_flight, 1)
+
+    def test_empty(self):
+        self.assertEqual(imgur.resolve_embeds([]), {})
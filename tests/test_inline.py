@@ -0,0 +1,187 @@
+import tempfile
+import unittest
+import urllib.request
+from unittest import mock
+
+from bs4 import BeautifulSoup
+
+import prepress
+from plugins.assets import shutdown_download_service
+from plugins.inline import InlineToken, InlineTokenType, InlineTokenizer
+from prepress import Article, add_footnotes, index_article, number_footnotes, replace_inline_code
+
+ALL_TYPES = list(InlineTokenType)
+
+
+def describe(pieces):
+    return [(piece.type, piece.text) if isinstance(piece, InlineToken) else piece for piece in pieces]
+
+
+class TestInlineTokenizer(unittest.TestCase):
+
+    def setUp(self):
+        self.tokenizer = InlineTokenizer(ALL_TYPES)
+
+    def test_no_markup(self):
+        self.assertFalse(self.tokenizer.has_markup('Nothing to see here.'))
+        self.assertEqual(self.tokenizer.tokenize('Nothing to see here.'), ['Nothing to see here.'])
+
+    def test_all_types(self):
+        self.assertEqual(
+            describe(self.tokenizer.tokenize(r'a [embed]https://imgur.com/abcde.png[/embed] b \(x\) c `d` e[1]')),
+            ['a ', (InlineTokenType.Embed, '[embed]https://imgur.com/abcde.png[/embed]'),
+             ' b ', (InlineTokenType.Math, r'\(x\)'),
+             ' c ', (InlineTokenType.Code, '`d`'),
+             ' e', (InlineTokenType.Footnote, '[1]'), '']
+        )
+
+    def test_math_over_code(self):
+        self.assertEqual(
+            describe(self.tokenizer.tokenize(r'`\(x\)`')),
+            ['`', (InlineTokenType.Math, r'\(x\)'), '`']
+        )
+
+    def test_code_cannot_span_math(self):
+        self.assertEqual(
+            describe(self.tokenizer.tokenize(r'`a \(x\) b`')),
+            ['`a ', (InlineTokenType.Math, r'\(x\)'), ' b`']
+        )
+
+    def test_code_over_footnote(self):
+        self.assertEqual(
+            describe(self.tokenizer.tokenize('`a[1]`')),
+            ['', (InlineTokenType.Code, '`a[1]`'), '']
+        )
+
+    def test_math_over_footnote(self):
+        self.assertEqual(
+            describe(self.tokenizer.tokenize(r'\[x_[2]\]')),
+            ['', (InlineTokenType.Math, r'\[x_[2]\]'), '']
+        )
+
+    def test_embed_over_footnote(self):
+        self.assertEqual(
+            describe(self.tokenizer.tokenize('[embed]https://imgur.com/abcde.png[/embed]')),
+            ['', (InlineTokenType.Embed, '[embed]https://imgur.com/abcde.png[/embed]'), '']
+        )
+
+    def test_subset(self):
+        tokenizer = InlineTokenizer([InlineTokenType.Footnote, InlineTokenType.Code])
+        self.assertEqual(tokenizer.token_types, [InlineTokenType.Code, InlineTokenType.Footnote])
+        self.assertEqual(
+            describe(tokenizer.tokenize(r'\(x[1]\)')),
+            [r'\(x', (InlineTokenType.Footnote, '[1]'), r'\)']
+        )
+
+
+class TestInlineMarkup(unittest.TestCase):
+
+    def make_article(self, content: str) -> Article:
+        article = Article()
+        article.title = 'Test'
+        article.content = BeautifulSoup(content, 'html.parser')
+        return article
+
+    def test_inline_code(self):
+        article = replace_inline_code(self.make_article('Use `print` and `len`.'))
+        self.assertEqual(str(article.content), 'Use <code>print</code> and <code>len</code>.')
+
+    def test_footnotes(self):
+        article = add_footnotes(self.make_article('One[] two[] <em>five[5]</em> six[] <code>[]</code>'))
+        self.assertEqual(
+            str(article.content),
+            'One<sup>1</sup> two<sup>2</sup> <em>five<sup>5</sup></em> six<sup>3</sup> <code>[]</code>'
+        )
+
+    def test_footnote_inside_code_is_code(self):
+        article = add_footnotes(replace_inline_code(self.make_article('See `arr[1]`[1]')))
+        self.assertEqual(str(article.content), 'See <code>arr[1]</code><sup>1</sup>')
+
+
+class TestArticleIndex(unittest.TestCase):
+
+    def make_article(self, content: str) -> Article:
+        article = Article()
+        article.title = 'Test'
+        article.raw_content = content
+        return article.parse()
+
+    def test_number_footnotes(self):
+        self.assertEqual(number_footnotes(['', '', '5', '', '4', '']), [1, 2, 5, 3, 4, 5])
+
+    def test_index(self):
+        downloads = []
+
+        def urlretrieve(url: str, filename: str):
+            downloads.append((url, filename))
+            open(filename, 'wb').close()
+
+        with tempfile.TemporaryDirectory() as asset_dir, \
+                mock.patch.object(prepress, 'ASSET_DIR', asset_dir), \
+                mock.patch.object(urllib.request, 'urlretrieve', urlretrieve), \
+                mock.patch.object(prepress, 'resize_image', lambda image_path: None), \
+                mock.patch('builtins.print'):
+            prepress.create_asset_dirs()
+            article = index_article(self.make_article(
+                'One[] `code[]` two[2] <img src="https://example.com/a/cat.png"/> <code>[9]</code> three[]'))
+            # indexing starts the download, wait for it before the stubs go away
+            shutdown_download_service()
+            cat_path = article.get_image_location('cat.png')
+        self.assertEqual(article.index.footnote_markers, ['', '2', ''])
+        self.assertEqual(article.index.footnote_numbers, [1, 2, 3])
+        self.assertEqual(article.index.images, {'https://example.com/a/cat.png': cat_path})
+        self.assertEqual(downloads, [('https://example.com/a/cat.png', cat_path)])
+
+    def test_embeds_resolved_once(self):
+        calls = []
+
+        def resolve_embeds(keys):
+            keys = list(keys)
+            calls.append(keys)
+            return {key: f'https://i.imgur.com/{key[1]}.png' for key in keys}
+
+        with tempfile.TemporaryDirectory() as asset_dir, \
+                mock.patch.object(prepress, 'ASSET_DIR', asset_dir), \
+                mock.patch.object(prepress, 'resolve_embeds', resolve_embeds), \
+                mock.patch.object(prepress, 'download_image', lambda url, local_path: None):
+            articles = [index_article(self.make_article(content)) for content in (
+                'A [embed]https://imgur.com/a/abcde[/embed]',
+                'B [embed]https://imgur.com/a/abcde[/embed] [embed]https://imgur.com/fghij[/embed]')]
+            prepress.resolve_index_embeds(articles)
+            shutdown_download_service()
+            self.assertEqual(calls, [[('a/', 'abcde'), ('a/', 'abcde'), ('', 'fghij')]])
+            self.assertEqual(articles[1].index.images['https://i.imgur.com/fghij.png'],
+                articles[1].get_image_location('fghij.png'))
+            # the handler only looks the galleries up
+            article = prepress.convert_imgur_embeds(articles[1])
+            self.assertEqual(calls[1:], [[]])
+        self.assertEqual(str(article.content),
+            'B <img src="https://i.imgur.com/abcde.png"/> <img src="https://i.imgur.com/fghij.png"/>')
+
+    def test_footnotes_use_index(self):
+        article = index_article(self.make_article('One[] two[]'))
+        article.index.footnote_numbers = [7, 8]
+        self.assertEqual(str(add_footnotes(article).content), 'One<sup>7</sup> two<sup>8</sup>')
+
+    def test_index_raw_content(self):
+        article = Article()
+        article.title = 'Test'
+        article.raw_content = '<p>One[] <code>two[]</p> three[] <!-- `four` --></code>'
+        article.raw_postscript = '<pre>five[]'
+        index_article(article)
+        self.assertEqual(article.index.footnote_markers, ['', ''])
+        self.assertEqual(article.index.markup, {InlineTokenType.Footnote, InlineTokenType.Code})
+
+    def test_skip_markup_missing_from_index(self):
+        article = index_article(self.make_article('One `two`'))
+        # markup the index didn't find isn't searched for
+        article.content.append(' three[]')
+        self.assertEqual(str(add_footnotes(article).content), 'One `two` three[]')
+
+    def test_footnotes_without_matching_index(self):
+        article = index_article(self.make_article('One[] two[]'))
+        article.content.append('three[]')
+        self.assertEqual(
+            str(add_footnotes(article).content),
+            'One<sup>1</sup> two<sup>2</sup>three<sup>3</sup>'
+        )
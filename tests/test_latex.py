@@ -0,0 +1,69 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from plugins import latex
+from plugins.latex import BEGIN_DOCUMENT, make_document, split_document
+
+
+class TestLatexFormat(unittest.TestCase):
+
+    def test_split_document(self):
+        document = make_document(r'x^2', display=True)
+        preamble, body = split_document(document)
+        self.assertEqual(preamble + body, document.dumps())
+        self.assertTrue(body.startswith(BEGIN_DOCUMENT))
+        self.assertIn(r'\newcommand{\Z}{\mathbb{Z}}', preamble)
+        self.assertIn(r'\[x^2\]', body)
+
+    def test_shared_preamble(self):
+        # every formula must share one preamble, or each would need its own format
+        first, _ = split_document(make_document(r'\frac{1}{2}'))
+        second, _ = split_document(make_document(r'\sum_i i', display=True))
+        self.assertEqual(first, second)
+
+
+FAKE_COMPILER = '''#!/bin/sh
+for last; do :; done
+case "$last" in
+    *slow*) sleep 5 ;;
+esac
+touch "${last%.tex}.pdf"
+'''
+
+
+@unittest.skipUnless(os.name == 'posix', 'fake compiler is a shell script')
+class TestLatexCompileService(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        compiler = os.path.join(self.tmp_dir.name, 'fakelatex')
+        with open(compiler, 'w') as compiler_file:
+            compiler_file.write(FAKE_COMPILER)
+        os.chmod(compiler, 0o755)
+        self.old_settings = latex.LATEX_COMPILER, latex.USE_PRECOMPILED_FORMAT, latex.COMPILE_TIMEOUT
+        latex.LATEX_COMPILER, latex.USE_PRECOMPILED_FORMAT, latex.COMPILE_TIMEOUT = compiler, False, 1
+        self.service = latex.LatexCompileService(max_workers=2)
+
+    def tearDown(self):
+        self.service.shutdown()
+        latex.LATEX_COMPILER, latex.USE_PRECOMPILED_FORMAT, latex.COMPILE_TIMEOUT = self.old_settings
+        self.tmp_dir.cleanup()
+
+    def test_compile(self):
+        filenames = [os.path.join(self.tmp_dir.name, f'formula{i}') for i in range(4)]
+        futures = [self.service.submit(f'x^{i}', filename) for i, filename in enumerate(filenames)]
+        for future in futures:
+            future.result()
+        for filename in filenames:
+            self.assertTrue(os.path.isfile(filename + '.pdf'))
+
+    def test_submitted_once(self):
+        filename = os.path.join(self.tmp_dir.name, 'formula')
+        self.assertIs(self.service.submit('x', filename), self.service.submit('x', filename))
+
+    def test_timeout(self):
+        future = self.service.submit('x', os.path.join(self.tmp_dir.name, 'slow'))
+        with self.assertRaises(subprocess.TimeoutExpired):
+            future.result()
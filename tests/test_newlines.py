@@ -0,0 +1,59 @@
+import random
+import unittest
+
+import bs4
+from bs4 import BeautifulSoup
+
+from prepress import Article, normalize_newlines, replace_newlines, separate_lines
+from util import LINE_SEPARATOR, keep_verbatim
+
+TEXTS = ['\n', '\n\n', 'line', 'a\nb', 'a\n\nb', ' \n', '\nend', 'start\n', '<!--note-->', '<br/>']
+TAGS = ['em', 'strong', 'p', 'pre', 'code', 'li']
+
+
+def reference_replace_newlines(article: Article) -> Article:
+    """replace_newlines as it was, searching the siblings of every text node.
+    """
+    for text_tag in article.content.find_all(string=True):
+        if not keep_verbatim(text_tag):
+            prev_sibling = text_tag.find_previous_sibling()
+            next_sibling = text_tag.find_next_sibling()
+            new_tag = bs4.NavigableString(separate_lines(str(text_tag), prev_sibling != None, next_sibling != None))
+            text_tag.replace_with(new_tag)
+    return article
+
+
+def random_html(rng: random.Random, depth: int = 0) -> str:
+    parts = []
+    for _ in range(rng.randint(0, 6)):
+        if depth < 3 and rng.random() < 0.3:
+            tag = rng.choice(TAGS)
+            parts.append(f'<{tag}>{random_html(rng, depth + 1)}</{tag}>')
+        else:
+            parts.append(rng.choice(TEXTS))
+    return ''.join(parts)
+
+
+def run(process, html: str) -> str:
+    article = Article()
+    article.content = BeautifulSoup(html, 'html.parser')
+    # like in POST_PROCESS, this turns comments into plain strings first
+    return str(process(normalize_newlines(article)).content)
+
+
+class TestReplaceNewlines(unittest.TestCase):
+
+    def test_poetry(self):
+        self.assertEqual(run(replace_newlines, 'Roses are red\nViolets are blue'),
+            f'Roses are red{LINE_SEPARATOR}Violets are blue')
+        # line breaks next to a tag are kept as they are
+        self.assertEqual(run(replace_newlines, '<em>Poetry</em> keeps\nits line breaks\n<em>too</em>'),
+            f'<em>Poetry</em> keeps{LINE_SEPARATOR}its line breaks\n<em>too</em>')
+        # paragraph breaks and verbatim text are left alone
+        self.assertEqual(run(replace_newlines, 'one\n\ntwo<pre>a\nb</pre>'), 'one\n\ntwo<pre>a\nb</pre>')
+
+    def test_matches_reference(self):
+        rng = random.Random(20201015)
+        for _ in range(500):
+            html = random_html(rng)
+            self.assertEqual(run(replace_newlines, html), run(reference_replace_newlines, html), repr(html))
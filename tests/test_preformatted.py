@@ -0,0 +1,68 @@
+import random
+import unittest
+
+from bs4 import BeautifulSoup
+
+from plugins.preformatted import (add_linenos, format_code_block_lines, highlight_code, iter_lines, number_lines,
+    rstrip_chunks, split_lines, wrap_lines)
+
+TOKENS = ['x', 'if', 'else', 'return', 'foo_bar', '"a string"', '#', '# a comment', '(', ')', '[', ']', ',', ';', '.',
+    '=', '+', '-', '/', '&', '<', '>', '|', '%', '_', '!', '1234567890', ' ', '  ', '\t', '"""doc', 'string"""',
+    'a_very_long_identifier_name_without_any_places_to_break_it']
+TAGS = ['strong', 'em', 'u']
+
+
+def format_whole_block(pre_contents: str, options) -> str:
+    pre_contents = add_linenos(highlight_code(pre_contents, options), options)
+    return str(wrap_lines(BeautifulSoup(f'<pre><code>{pre_contents}</code></pre>', 'html.parser')))
+
+
+def random_line(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.choice([0, 1, 4, 10, 20, 40])):
+        token = rng.choice(TOKENS).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        roll = rng.random()
+        if roll < 0.15:
+            token = f'<{rng.choice(TAGS)}>{token}</{rng.choice(TAGS)}>'
+        elif roll < 0.2:
+            token = f'<{rng.choice(TAGS)}>{token}'
+        parts.append(token + (' ' if rng.random() < 0.6 else ''))
+    return ''.join(parts)
+
+
+class TestCodeBlockLines(unittest.TestCase):
+
+    def test_iter_lines(self):
+        for text in ['', 'a', 'a\n', 'a\nb', '\n\n']:
+            self.assertEqual(list(iter_lines(text)), [line + '\n' for line in text.split('\n')[:-1]] + [text.split('\n')[-1]])
+
+    def test_split_lines(self):
+        for chunks in [[], [''], ['a', 'b\nc', '\n', ''], ['\n\n', 'a\n', 'b']]:
+            self.assertEqual(list(split_lines(chunks)), list(iter_lines(''.join(chunks))))
+
+    def test_rstrip_chunks(self):
+        for chunks in [[], ['  '], ['a ', ' ', 'b\n', '\n  '], ['<em>a\n</em>', '\n']]:
+            self.assertEqual(''.join(rstrip_chunks(chunks)), ''.join(chunks).rstrip())
+
+    def test_number_lines(self):
+        for text in ['', 'a', 'a\n', 'a\nb\nc']:
+            options = {'linenos': True}
+            self.assertEqual(''.join(number_lines(iter_lines(text), options)), add_linenos(text, options))
+
+    def test_wrapping(self):
+        pre_contents = 'print("FizzBuzz" if i % 15 == 0 else "Fizz" if i % 3 == 0 else "Buzz" if i % 5 == 0 else i)'
+        options = {'lang': 'python', 'linenos': True}
+        self.assertEqual(str(format_code_block_lines(pre_contents, options)), format_whole_block(pre_contents, options))
+
+    def test_matches_whole_block(self):
+        # property: for normal-sized blocks, formatting a line at a time changes nothing
+        rng = random.Random(20201016)
+        for _ in range(300):
+            pre_contents = '\n'.join(random_line(rng) for _ in range(rng.randint(0, 8))) + rng.choice(['', '\n', '  '])
+            options = {}
+            if rng.random() < 0.6:
+                options['lang'] = rng.choice(['python', 'c', 'no-such-language'])
+            if rng.random() < 0.5:
+                options['linenos'] = True
+            self.assertEqual(str(format_code_block_lines(pre_contents, options)), format_whole_block(pre_contents, options),
+                repr((pre_contents, options)))
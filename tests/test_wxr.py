@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from plugins.wxr import find_outside_cdata, iter_item_spans, read_tagged_items
+from prepress import CONTENT_TAG, filter_articles, filter_items
+from tests.test_filter_articles import DUMP
+
+TRICKY_DUMP = '''<?xml version="1.0" encoding="UTF-8" ?>
+<rss version="2.0"
+\txmlns:content="http://purl.org/rss/1.0/modules/content/"
+\txmlns:wp="http://wordpress.org/export/1.2/"
+>
+<channel>
+    <item>
+        <title>Markup in content</title>
+        <content:encoded><![CDATA[An <item>v1i1</item> in the text]]></content:encoded>
+        <category domain="category" nicename="editor-okayed"><![CDATA[Editor okayed]]></category>
+        <category domain="post_tag" nicename="v1i1"><![CDATA[v1i1]]></category>
+    </item>
+    <item>
+        <title>Ampersand</title>
+        <content:encoded><![CDATA[Hi]]></content:encoded>
+        <category domain="category" nicename="editor-okayed"><![CDATA[Editor okayed]]></category>
+        <category domain="post_tag" nicename="a-b">a &amp; b</category>
+    </item>
+</channel>
+</rss>'''
+
+
+class TestDumpReader(unittest.TestCase):
+
+    def read(self, dump: str, tag: str):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'dump.xml')
+            with open(path, 'w', encoding='utf-8') as dump_file:
+                dump_file.write(dump)
+            return filter_items(read_tagged_items(path, tag), tag)
+
+    def test_find_outside_cdata(self):
+        buf = b'<![CDATA[<item>]]><item>'
+        self.assertEqual(find_outside_cdata(buf, b'<item>', 0), 18)
+        self.assertEqual(find_outside_cdata(b'<![CDATA[<item>', b'<item>', 0), -1)
+
+    def test_item_spans(self):
+        buf = TRICKY_DUMP.encode('utf-8')
+        spans = list(iter_item_spans(buf))
+        self.assertEqual(len(spans), 2)
+        for start, end in spans:
+            self.assertTrue(buf[start:end].startswith(b'<item>'))
+            self.assertTrue(buf[start:end].endswith(b'</item>'))
+
+    def test_matches_element_tree(self):
+        tree = ElementTree.ElementTree(ElementTree.fromstring(DUMP))
+        for tag in ['v1i1', 'v1i2', 'v1i3']:
+            expected = [(article.title, article.author, article.raw_content) for article in filter_articles(tree, tag)]
+            actual = [(article.title, article.author, article.raw_content) for article in self.read(DUMP, tag)]
+            self.assertEqual(actual, expected)
+
+    def test_markup_in_content(self):
+        articles = self.read(TRICKY_DUMP, 'v1i1')
+        self.assertEqual([article.title for article in articles], ['Markup in content'])
+        self.assertEqual(articles[0].raw_content, 'An <item>v1i1</item> in the text')
+
+    def test_escaped_tag(self):
+        self.assertEqual([article.title for article in self.read(TRICKY_DUMP, 'a & b')], ['Ampersand'])
+
+    def test_namespaces(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'dump.xml')
+            with open(path, 'w', encoding='utf-8') as dump_file:
+                dump_file.write(TRICKY_DUMP)
+            item = next(read_tagged_items(path, 'v1i1'))
+            self.assertIsNotNone(item.find(CONTENT_TAG))
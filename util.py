@@ -1,10 +1,13 @@
 import functools
+import os
 from bs4 import Tag
 
 # Unicode LINE SEPARATOR character
 LINE_SEPARATOR = '\u2028'
 # Tags within which we should not be replacing content
 VERBATIM_TAGS = ('pre', 'code')
+# Directory for things worth keeping between runs
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'prepress')
 
 
 def keep_verbatim(tag: Tag) -> bool:
@@ -22,3 +25,35 @@ __html_escape_lut = str.maketrans({
 def html_escape(value):
     return value.translate(__html_escape_lut)
 
+
+# Maximum number of distinct inputs each memoized text transform remembers
+TEXT_TRANSFORM_CACHE_SIZE = 4096
+# Longest text a memoized text transform remembers. Longer text rarely repeats, and hashing it
+# costs about as much as transforming it again
+MEMOIZED_TEXT_LENGTH = 64
+# Every memoized text transform, so we can report how well their caches are doing
+__memoized_transforms = []
+
+def memoized_transform(func):
+    """Memoizes a pure string transform, which takes the text first, with a bounded LRU cache.
+    Only short strings like "\\n" and ", " are cached, since they make up a good share of text
+    nodes and keep coming back. Anything longer than MEMOIZED_TEXT_LENGTH is transformed every time.
+    Only pass plain str, not NavigableString, or the cache will keep whole trees alive.
+    """
+    cached = functools.lru_cache(maxsize=TEXT_TRANSFORM_CACHE_SIZE)(func)
+
+    @functools.wraps(func)
+    def transform(text, *args):
+        if len(text) > MEMOIZED_TEXT_LENGTH:
+            return func(text, *args)
+        return cached(text, *args)
+
+    transform.cache_info = cached.cache_info
+    transform.cache_clear = cached.cache_clear
+    __memoized_transforms.append(transform)
+    return transform
+
+def get_transform_cache_stats():
+    """Returns (name, hits, misses) for every memoized text transform.
+    """
+    return [(func.__name__, func.cache_info().hits, func.cache_info().misses) for func in __memoized_transforms]